@@ -1,24 +1,36 @@
+import asyncio
+import gzip
+import hashlib
 import json
 import os
 import time
 import uuid
-import threading
-from typing import Any, Dict, Optional
+from collections import deque
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
 from urllib.parse import urlencode
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import httpx
-import redis
+import redis.asyncio as aioredis
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.serialization import load_der_public_key
 
+import bmo_http
+import collectcache
+import filestore
+import jobqueue
+import metrics
+import mirror
+import serde
+from jobqueue import job_key
+
 REDIS_URL = os.environ.get("REDIS_URL", "redis://redis:6379/0")
-QUEUE_KEY = os.environ.get("JOB_QUEUE_KEY", "bmo_relay_jobs")
 FILES_DIR = os.environ.get("FILES_DIR", "/data/files")
 AUTH_SESSION_KEY = os.environ.get("BMO_AUTH_REDIS_KEY", "bmo:auth:session")
+AUTH_CHANNEL = os.environ.get("BMO_AUTH_REDIS_CHANNEL", "bmo:auth:changed")
 BMO_BASE_URL = os.environ.get("BMO_BASE_URL", "https://bmo.meiling.com:8023").rstrip("/")
 BMO_LOGIN_PAGE_ENDPOINT = os.environ.get(
     "BMO_LOGIN_PAGE_ENDPOINT", "/data/sys-portal/sysPortalLoginPage/loginPage"
@@ -29,6 +41,9 @@ BMO_HTTP_TIMEOUT_MS = int(os.environ.get("BMO_HTTP_TIMEOUT_MS", "60000"))
 SYNC_STATUS_KEY = os.environ.get("BMO_SYNC_STATUS_REDIS_KEY", "bmo:sync:status")
 SYNC_LOCK_KEY = os.environ.get("BMO_SYNC_LOCK_REDIS_KEY", "bmo:sync:lock")
 SYNC_TRIGGER_KEY = os.environ.get("BMO_SYNC_TRIGGER_REDIS_KEY", "bmo:sync:trigger")
+SYNC_WATERMARK_KEY = os.environ.get("BMO_SYNC_WATERMARK_REDIS_KEY", "bmo:sync:watermark")
+SYNC_FINGERPRINT_KEY = os.environ.get("BMO_SYNC_FINGERPRINT_REDIS_KEY", "bmo:sync:fingerprints")
+HTTP_STATS_KEY_PREFIX = os.environ.get("BMO_HTTP_STATS_REDIS_PREFIX", "bmo:http:stats:")
 CRAFTSYS_BMO_PERSIST_URL = str(os.environ.get("CRAFTSYS_BMO_PERSIST_URL", "")).strip()
 CRAFTSYS_BMO_PERSIST_TOKEN = str(os.environ.get("CRAFTSYS_BMO_PERSIST_TOKEN", "")).strip()
 BMO_SYNC_INTERVAL_MS = int(os.environ.get("BMO_SYNC_INTERVAL_MS", "300000"))
@@ -37,21 +52,75 @@ BMO_SYNC_PAGE_SIZE = int(os.environ.get("BMO_SYNC_PAGE_SIZE", "200"))
 BMO_SYNC_MAX_PAGES = int(os.environ.get("BMO_SYNC_MAX_PAGES", "10"))
 BMO_SYNC_LOCK_TTL_SEC = int(os.environ.get("BMO_SYNC_LOCK_TTL_SEC", "600"))
 BMO_SYNC_JOB_TIMEOUT_MS = int(os.environ.get("BMO_SYNC_JOB_TIMEOUT_MS", "180000"))
+# pages after the first are collected concurrently, at most this many in flight
+BMO_SYNC_FANOUT = int(os.environ.get("BMO_SYNC_FANOUT", "4"))
+# incremental runs only fetch records whose watermark field is >= the last value seen;
+# a full run still happens every BMO_SYNC_FULL_INTERVAL_MS to catch anything missed.
+# List rows carry no system create/modify time; fd_col_fp487h is the list view's own time
+# column (see services/bmoSync.js), so it is the only field an incremental run can page on.
+BMO_SYNC_INCREMENTAL = str(os.environ.get("BMO_SYNC_INCREMENTAL", "1")).strip().lower() not in {"0", "false", "no"}
+BMO_SYNC_WATERMARK_FIELD = str(os.environ.get("BMO_SYNC_WATERMARK_FIELD", "fd_col_fp487h")).strip()
+# an unquoted "$gte" in an env file can be interpolated away to ""
+BMO_SYNC_WATERMARK_OP = str(os.environ.get("BMO_SYNC_WATERMARK_OP") or "").strip() or "$gte"
+BMO_SYNC_FULL_INTERVAL_MS = int(os.environ.get("BMO_SYNC_FULL_INTERVAL_MS", "3600000"))
+# only changed records are persisted, in chunks that stay under express.json()'s 100kb
+# default limit (measured after inflating); bodies above the threshold are gzip-encoded
+BMO_SYNC_PERSIST_CHUNK_SIZE = int(os.environ.get("BMO_SYNC_PERSIST_CHUNK_SIZE", "100"))
+BMO_SYNC_PERSIST_GZIP_MIN_BYTES = int(os.environ.get("BMO_SYNC_PERSIST_GZIP_MIN_BYTES", "8192"))
+# collected pages waiting to be persisted; a full buffer pauses collection (backpressure)
+BMO_SYNC_PIPELINE_DEPTH = int(os.environ.get("BMO_SYNC_PIPELINE_DEPTH", "2"))
 BMO_SYNC_ENABLED = str(os.environ.get("BMO_SYNC_ENABLED", "1")).strip().lower() not in {
     "0",
     "false",
     "no",
 }
 
-r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
-app = FastAPI(title="bmo-relay-api")
-_scheduler_started = False
-_scheduler_guard = threading.Lock()
+# long-poll GET /jobs/{id}?waitMs= and the SSE stream are capped so a client cannot hold
+# a connection open forever
+JOB_WAIT_MAX_MS = int(os.environ.get("JOB_WAIT_MAX_MS", "30000"))
+JOB_EVENTS_MAX_MS = int(os.environ.get("JOB_EVENTS_MAX_MS", "600000"))
+
+# POST /jobs/batch writes every job in one pipelined transaction; cap its size
+JOB_BATCH_MAX = int(os.environ.get("JOB_BATCH_MAX", "1000"))
+
+JOB_TYPES = {"collect", "download_attachment", "download_attachments", "writeback", "upload_attachment"}
+
+# every route is async: a slow BMO probe or a waiting sync parks a coroutine, not one of
+# the threadpool's slots, so /health and /jobs stay responsive under load
+r = aioredis.Redis.from_url(REDIS_URL, decode_responses=True)
+# offloaded job results are zlib blobs and must be read without utf-8 decoding
+rb = aioredis.Redis.from_url(REDIS_URL)
+_enqueue_script = r.register_script(jobqueue.ENQUEUE_LUA)
+
+
+class RelayJSONResponse(JSONResponse):
+    """JSON responses rendered through serde (orjson when installed) instead of the stdlib.
+
+    Routes that return large job results build this directly, which also skips FastAPI's
+    jsonable_encoder walk over every row.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return serde.dumps_bytes(content)
+
+
+app = FastAPI(title="bmo-relay-api", default_response_class=RelayJSONResponse)
+_scheduler_task: Optional["asyncio.Task[None]"] = None
+# strong references to fire-and-forget syncs so they are not garbage-collected mid-run
+_background_tasks: Set["asyncio.Task[Any]"] = set()
 
 
 class JobCreate(BaseModel):
     type: str
     payload: Dict[str, Any] = {}
+    priority: Optional[str] = None
+    # skip single-flight coalescing and always create a new job
+    force: Optional[bool] = None
+
+
+class JobBatchCreate(BaseModel):
+    jobs: List[JobCreate]
+    priority: Optional[str] = None
 
 
 class AuthSetBody(BaseModel):
@@ -67,10 +136,7 @@ class AuthLoginBody(BaseModel):
 class SyncRunBody(BaseModel):
     trigger: Optional[str] = None
     waitMs: Optional[int] = None
-
-
-def job_key(job_id: str) -> str:
-    return f"bmo:job:{job_id}"
+    full: Optional[bool] = None
 
 
 def json_or_text(value: str):
@@ -78,25 +144,36 @@ def json_or_text(value: str):
     if not s:
         return None
     try:
-        return json.loads(s)
+        return serde.loads(s)
     except Exception:
         return s
 
 
-def normalize_job(data: Dict[str, str]) -> Dict[str, Any]:
+def normalize_job(data: Dict[str, str], result: Any = None) -> Dict[str, Any]:
     return {
         "id": data.get("id"),
         "type": data.get("type"),
         "status": data.get("status"),
+        "priority": data.get("priority") or jobqueue.DEFAULT_LANE,
         "payload": json_or_text(data.get("payload", "")) or {},
         "created_at": int(data.get("created_at") or 0),
         "started_at": int(data.get("started_at") or 0) or None,
         "finished_at": int(data.get("finished_at") or 0) or None,
         "error": data.get("error") or "",
-        "result": json_or_text(data.get("result", "")),
+        "attempts": int(data.get("attempts") or 0),
+        "resultBytes": int(data.get("result_bytes") or 0) or None,
+        # "hit"/"stale" when a collect was answered from the page cache without a BMO call
+        "cache": data.get("cache") or None,
+        "result": result,
     }
 
 
+async def _job_view(data: Dict[str, str], include_result: bool = True) -> Dict[str, Any]:
+    # decoding a 200-row collect result is the expensive part; skip it unless asked
+    result = await jobqueue.load_result_async(rb, data) if include_result else None
+    return normalize_job(data, result)
+
+
 def _norm_timeout_ms(timeout_ms: int = BMO_HTTP_TIMEOUT_MS) -> float:
     v = int(timeout_ms or BMO_HTTP_TIMEOUT_MS)
     if v <= 0:
@@ -104,8 +181,8 @@ def _norm_timeout_ms(timeout_ms: int = BMO_HTTP_TIMEOUT_MS) -> float:
     return max(1.0, v / 1000.0)
 
 
-def _load_auth_state() -> Dict[str, str]:
-    from_redis = r.hgetall(AUTH_SESSION_KEY) or {}
+async def _load_auth_state() -> Dict[str, str]:
+    from_redis = await r.hgetall(AUTH_SESSION_KEY) or {}
     if from_redis:
         return {
             "cookie": str(from_redis.get("cookie") or ""),
@@ -121,8 +198,9 @@ def _load_auth_state() -> Dict[str, str]:
     }
 
 
-def _save_auth_state(cookie: str, token: str, source: str) -> None:
-    r.hset(
+async def _save_auth_state(cookie: str, token: str, source: str) -> None:
+    pipe = r.pipeline(transaction=True)
+    pipe.hset(
         AUTH_SESSION_KEY,
         mapping={
             "cookie": str(cookie or ""),
@@ -131,31 +209,36 @@ def _save_auth_state(cookie: str, token: str, source: str) -> None:
             "source": str(source or "api"),
         },
     )
+    pipe.hincrby(AUTH_SESSION_KEY, "version", 1)
+    version = (await pipe.execute())[-1]
+    # workers serve auth headers from memory and reload only on this message
+    await r.publish(AUTH_CHANNEL, str(version))
 
 
-def _save_sync_status(**kwargs: Any) -> Dict[str, Any]:
+async def _save_sync_status(**kwargs: Any) -> Dict[str, Any]:
     payload = {}
     for key, value in kwargs.items():
         if value is None:
             payload[key] = ""
         elif isinstance(value, (dict, list)):
-            payload[key] = json.dumps(value, ensure_ascii=False)
+            payload[key] = serde.dumps(value)
         else:
             payload[key] = str(value)
     if payload:
-        r.hset(SYNC_STATUS_KEY, mapping=payload)
-    return _load_sync_status()
+        await r.hset(SYNC_STATUS_KEY, mapping=payload)
+    return await _load_sync_status()
 
 
-def _load_sync_status() -> Dict[str, Any]:
-    raw = r.hgetall(SYNC_STATUS_KEY) or {}
+async def _load_sync_status() -> Dict[str, Any]:
+    raw = await r.hgetall(SYNC_STATUS_KEY) or {}
+    watermark = await r.hget(SYNC_WATERMARK_KEY, "value")
 
     def _read_json(name: str):
         value = str(raw.get(name) or "").strip()
         if not value:
             return None
         try:
-            return json.loads(value)
+            return serde.loads(value)
         except Exception:
             return value
 
@@ -176,7 +259,16 @@ def _load_sync_status() -> Dict[str, Any]:
         "lastTraceId": str(raw.get("lastTraceId") or "").strip() or None,
         "lastFetched": _read_int("lastFetched"),
         "lastPersisted": _read_int("lastPersisted"),
+        "lastUnchanged": _read_int("lastUnchanged"),
+        "lastRemoved": _read_int("lastRemoved"),
         "lastTotal": _read_int("lastTotal"),
+        "lastMode": str(raw.get("lastMode") or "").strip() or None,
+        "lastFullAt": str(raw.get("lastFullAt") or "").strip() or None,
+        "watermark": str(watermark or "").strip() or None,
+        "lastMirrored": _read_int("lastMirrored"),
+        "lastMirrorError": str(raw.get("lastMirrorError") or "").strip() or None,
+        "lastDuplicates": _read_int("lastDuplicates"),
+        "lastWatermarkWarning": str(raw.get("lastWatermarkWarning") or "").strip() or None,
         "lastPersistResponse": _read_json("lastPersistResponse"),
     }
 
@@ -185,144 +277,544 @@ def _sync_ready() -> bool:
     return BMO_SYNC_ENABLED and bool(CRAFTSYS_BMO_PERSIST_URL) and bool(CRAFTSYS_BMO_PERSIST_TOKEN)
 
 
-def _enqueue_job(job_type: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    job_id = f"job_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
-    now = int(time.time())
-    data = {
-        "id": job_id,
+def _new_job_record(job_type: str, payload: Dict[str, Any], priority: str) -> Dict[str, str]:
+    return {
+        "id": f"job_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}",
         "type": job_type,
         "status": "queued",
-        "payload": json.dumps(payload, ensure_ascii=False),
-        "created_at": str(now),
+        "priority": priority,
+        "payload": serde.dumps(payload),
+        "created_at": str(int(time.time())),
         "started_at": "",
         "finished_at": "",
         "error": "",
         "result": "",
     }
-    r.hset(job_key(job_id), mapping=data)
-    r.rpush(QUEUE_KEY, job_id)
-    return normalize_job(data)
-
-
-def _wait_job_done(job_id: str, timeout_ms: int) -> Dict[str, Any]:
-    deadline = time.time() + max(3.0, _norm_timeout_ms(timeout_ms))
-    while time.time() < deadline:
-        data = r.hgetall(job_key(job_id))
-        if data:
-            normalized = normalize_job(data)
-            state = str(normalized.get("status") or "").strip().lower()
-            if state in {"success", "failed"}:
-                return normalized
-        time.sleep(1.0)
+
+
+def _cache_eligible(spec: Dict[str, Any]) -> bool:
+    if spec["type"] != "collect" or not collectcache.enabled() or spec.get("cache") is False:
+        return False
+    return not (bool(spec.get("force")) or bool((spec.get("payload") or {}).get("force")))
+
+
+async def _collect_cache_lookup(specs: List[Dict[str, Any]]) -> Tuple[List[Optional[Dict[str, Any]]], int]:
+    """Fresh or stale cache entries for the collect specs (None for everything else), plus the
+    current cache generation."""
+    hits: List[Optional[Dict[str, Any]]] = [None] * len(specs)
+    if not any(spec["type"] == "collect" for spec in specs):
+        return hits, 0
+    eligible = [i for i, spec in enumerate(specs) if _cache_eligible(spec)]
+    read = rb.pipeline(transaction=False)
+    read.get(collectcache.GENERATION_KEY)
+    for i in eligible:
+        read.hmget(collectcache.cache_key(specs[i].get("payload") or {}), "generation", "stored_at_ms", "bytes", "body")
+    replies = await read.execute()
+    current, now_ms = int(replies[0] or 0), int(time.time() * 1000)
+    for i, entry in zip(eligible, replies[1:]):
+        hits[i] = collectcache.classify(entry, current, now_ms) or {"state": "miss"}
+    return hits, current
+
+
+def _cached_job_record(spec: Dict[str, Any], hit: Dict[str, Any]) -> Dict[str, str]:
+    # a cache answer is an already-finished job, so callers poll and read it like any other
+    now = str(int(time.time()))
+    data = _new_job_record(spec["type"], spec.get("payload") or {}, spec["priority"])
+    data.update(
+        status="success",
+        started_at=now,
+        finished_at=now,
+        result_ref=f"{job_key(data['id'])}:result:{uuid.uuid4().hex[:12]}",
+        result_encoding="zlib+json",
+        result_bytes=str(hit["bytes"]),
+        cache=hit["state"],
+        cache_age_ms=str(hit["ageMs"]),
+    )
+    return data
+
+
+async def _enqueue_jobs(specs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Create jobs from validated {type, payload, priority, force} specs in one Redis round trip.
+
+    Collects the page cache can answer come back as finished jobs; a stale answer also
+    queues one refresh. Idempotent types go through the single-flight enqueue script and
+    may come back attached to an identical job that is already queued, running or just
+    finished.
+    """
+    hits, generation = await _collect_cache_lookup(specs)
+    cached = {i: hit for i, hit in enumerate(hits) if hit and hit["state"] != "miss"}
+    # (index into specs, spec); refreshes have no index and are not reported to the caller
+    queued = [(i, spec) for i, spec in enumerate(specs) if i not in cached]
+    queued += [(None, {**specs[i], "cache": False}) for i, hit in cached.items() if hit["state"] == "stale"]
+
+    records = [_new_job_record(x["type"], x.get("payload") or {}, x["priority"]) for _, x in queued]
+    dedupe_keys = [
+        jobqueue.dedupe_key(x["type"], x.get("payload") or {}, f"cache:{generation}" if x["type"] == "collect" else "")
+        for _, x in queued
+    ]
+    by_lane: Dict[str, List[str]] = {}
+    pipe = r.pipeline(transaction=True)
+    for (_, spec), data, dedupe in zip(queued, records, dedupe_keys):
+        if dedupe:
+            data["dedupe_key"] = dedupe
+            # a payload-level force (re-download) is a refresh request, never coalesced
+            force = bool(spec.get("force")) or bool((spec.get("payload") or {}).get("force"))
+            keys, args = jobqueue.enqueue_call(data, dedupe, force)
+            await _enqueue_script(keys=keys, args=args, client=pipe)
+        else:
+            pipe.hset(job_key(data["id"]), mapping=data)
+            by_lane.setdefault(data["priority"], []).append(data["id"])
+    for lane, job_ids in by_lane.items():
+        jobqueue.push_jobs(pipe, job_ids, lane)
+    created: List[Optional[Dict[str, Any]]] = [None] * len(specs)
+    for i, hit in cached.items():
+        data = _cached_job_record(specs[i], hit)
+        pipe.set(data["result_ref"], hit["body"], ex=jobqueue.JOB_TTL_SEC if jobqueue.JOB_TTL_SEC > 0 else None)
+        pipe.hset(job_key(data["id"]), mapping=data)
+        if jobqueue.JOB_TTL_SEC > 0:
+            pipe.expire(job_key(data["id"]), jobqueue.JOB_TTL_SEC)
+        created[i] = normalize_job(data)
+    counts = {"hits": 0, "staleHits": 0, "misses": 0}
+    for hit in hits:
+        if hit:
+            counts[{"hit": "hits", "stale": "staleHits", "miss": "misses"}[hit["state"]]] += 1
+    counts["refreshes"] = counts["staleHits"]
+    for name, value in counts.items():
+        if value:
+            pipe.hincrby(collectcache.STATS_KEY, name, value)
+    replies = await pipe.execute()
+
+    attached = []
+    # queued commands come first in the transaction, one reply per record
+    reply_iter = iter(replies)
+    for (index, _), data, dedupe in zip(queued, records, dedupe_keys):
+        if not dedupe:
+            reply = None
+            next(reply_iter)
+        else:
+            job_id, existed = next(reply_iter)
+            reply = str(job_id) if int(existed) else None
+        if index is None:
+            continue
+        if reply:
+            attached.append((index, reply))
+        else:
+            created[index] = normalize_job(data)
+    if attached:
+        read = r.pipeline(transaction=False)
+        for _, job_id in attached:
+            read.hgetall(job_key(job_id))
+        for (index, _), existing in zip(attached, await read.execute()):
+            created[index] = {**normalize_job(existing), "deduplicated": True}
+    return created
+
+
+async def _enqueue_job(
+    job_type: str,
+    payload: Dict[str, Any],
+    priority: str = "interactive",
+    force: bool = False,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    spec = {"type": job_type, "payload": payload, "priority": priority, "force": force, "cache": use_cache}
+    return (await _enqueue_jobs([spec]))[0]
+
+
+async def _wait_job_done(job_id: str, timeout_ms: int) -> Dict[str, Any]:
+    # woken by the worker's completion event instead of sleeping between polls
+    data = await jobqueue.wait_for_terminal_async(r, job_id, max(3.0, _norm_timeout_ms(timeout_ms)))
+    if data:
+        return await _job_view(data)
     raise RuntimeError(f"sync collect job timeout ({timeout_ms}ms)")
 
 
-def _collect_all_pages(page_size: int, max_pages: int) -> Dict[str, Any]:
-    offset = 0
-    total = None
-    trace_id = None
-    fetched_at = None
-    items = []
-
-    for _ in range(max_pages):
-        created = _enqueue_job("collect", {"pageSize": page_size, "offset": offset})
-        job_id = str(created.get("id") or "").strip()
-        if not job_id:
-            raise RuntimeError("collect 创建任务失败（缺少 jobId）")
-        done = _wait_job_done(job_id, BMO_SYNC_JOB_TIMEOUT_MS)
-        if str(done.get("status") or "").strip().lower() != "success":
-            raise RuntimeError(str(done.get("error") or "collect failed"))
-        result = done.get("result") if isinstance(done.get("result"), dict) else {}
-        page_list = result.get("list") if isinstance(result.get("list"), list) else []
-        if result.get("traceId"):
-            trace_id = str(result.get("traceId"))
-        if result.get("fetchedAt"):
-            fetched_at = str(result.get("fetchedAt"))
-        if result.get("total") is not None:
-            try:
-                total = int(result.get("total"))
-            except Exception:
-                total = total
-        items.extend(page_list)
-        if not page_list or len(page_list) < page_size:
-            break
-        offset += page_size
-        if total is not None and offset >= total:
-            break
+async def _collect_page(page_size: int, offset: int, query: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    payload = {**(query or {}), "pageSize": page_size, "offset": offset}
+    # the sync diffs against what it persisted last time and needs what BMO has now: no
+    # cached page, and no attaching to a collect that finished before this run started
+    created = await _enqueue_job("collect", payload, priority="sync", force=True, use_cache=False)
+    job_id = str(created.get("id") or "").strip()
+    if not job_id:
+        raise RuntimeError("collect 创建任务失败（缺少 jobId）")
+    done = await _wait_job_done(job_id, BMO_SYNC_JOB_TIMEOUT_MS)
+    if str(done.get("status") or "").strip().lower() != "success":
+        raise RuntimeError(str(done.get("error") or "collect failed"))
+    return done.get("result") if isinstance(done.get("result"), dict) else {}
+
+
+def _watermark_max(current: Any, candidate: Any) -> Any:
+    # BMO returns either epoch millis or "YYYY-MM-DD HH:MM:SS" strings; both order correctly
+    if candidate in (None, ""):
+        return current
+    if current in (None, ""):
+        return candidate
+    try:
+        return candidate if float(candidate) > float(current) else current
+    except (TypeError, ValueError):
+        return candidate if str(candidate) > str(current) else current
 
-    return {
-        "list": items,
-        "fetched": len(items),
-        "total": total if total is not None else len(items),
-        "traceId": trace_id,
-        "fetchedAt": fetched_at or time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-    }
 
+def _page_list(page: Dict[str, Any]) -> List[Any]:
+    return page.get("list") if isinstance(page.get("list"), list) else []
 
-def _persist_mould_list(result: Dict[str, Any], source: str) -> Dict[str, Any]:
+
+async def _iter_pages(
+    page_size: int, max_pages: int, query: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yield collected pages in offset order, stopping after the first short page."""
+    first = await _collect_page(page_size, 0, query)
+    yield first
+    if len(_page_list(first)) < page_size:
+        return
+    try:
+        total = int(first.get("total")) if first.get("total") is not None else None
+    except Exception:
+        total = None
+
+    if total is None:
+        # no usable total: walk pages one after another
+        for offset in range(page_size, max_pages * page_size, page_size):
+            page = await _collect_page(page_size, offset, query)
+            yield page
+            if len(_page_list(page)) < page_size:
+                return
+        return
+
+    # page one told us totalSize, so the remaining offsets are known up front and can be
+    # fanned out; a sliding window keeps at most BMO_SYNC_FANOUT pages in flight or waiting
+    offsets = iter(range(page_size, min(total, max_pages * page_size), page_size))
+    fanout = max(1, BMO_SYNC_FANOUT)
+    window: "deque[asyncio.Task[Dict[str, Any]]]" = deque()
+    try:
+        for offset in offsets:
+            window.append(asyncio.create_task(_collect_page(page_size, offset, query)))
+            if len(window) >= fanout:
+                break
+        while window:
+            # the first failing page (by offset) fails the sync, same as the sequential walk
+            page = await window.popleft()
+            offset = next(offsets, None)
+            if offset is not None:
+                window.append(asyncio.create_task(_collect_page(page_size, offset, query)))
+            yield page
+            if len(_page_list(page)) < page_size:
+                return
+    finally:
+        for task in window:
+            task.cancel()
+        # reap what was still in flight so no page is left pending or with an unretrieved error
+        await asyncio.gather(*window, return_exceptions=True)
+
+
+async def _plan_sync(full: bool) -> Dict[str, Any]:
+    """Pick full or incremental mode and build the collect query for it."""
+    query: Dict[str, Any] = {"watermarkField": BMO_SYNC_WATERMARK_FIELD} if BMO_SYNC_WATERMARK_FIELD else {}
+    state = await r.hgetall(SYNC_WATERMARK_KEY) or {}
+    watermark = str(state.get("value") or "").strip()
+    last_full_ms = int(state.get("lastFullAtMs") or 0) if str(state.get("lastFullAtMs") or "").isdigit() else 0
+    full_due = time.time() * 1000 - last_full_ms >= max(60000, BMO_SYNC_FULL_INTERVAL_MS)
+    if (
+        full
+        or full_due
+        or not BMO_SYNC_INCREMENTAL
+        or not BMO_SYNC_WATERMARK_FIELD
+        or not watermark
+        or state.get("field") != BMO_SYNC_WATERMARK_FIELD
+        # a new or wiped mirror only fills up from a full listing
+        or await _mirror_call(mirror.is_empty) is True
+    ):
+        return {"mode": "full", "query": query}
+    # >= re-reads the boundary records, which is harmless because persisting is an upsert;
+    # ascending order means a run capped by BMO_SYNC_MAX_PAGES still advances the watermark
+    query["conditions"] = {BMO_SYNC_WATERMARK_FIELD: {BMO_SYNC_WATERMARK_OP: watermark}}
+    query["sorts"] = {BMO_SYNC_WATERMARK_FIELD: "asc"}
+    return {"mode": "incremental", "query": query, "watermark": watermark}
+
+
+async def _advance_watermark(mode: str, collected: Dict[str, Any]) -> None:
+    state = await r.hgetall(SYNC_WATERMARK_KEY) or {}
+    previous = state.get("value") if state.get("field") == BMO_SYNC_WATERMARK_FIELD else None
+    mapping = {"field": BMO_SYNC_WATERMARK_FIELD}
+    value = _watermark_max(previous, collected.get("watermark"))
+    if value not in (None, ""):
+        mapping["value"] = str(value)
+    if mode == "full":
+        mapping["lastFullAtMs"] = str(int(time.time() * 1000))
+    await r.hset(SYNC_WATERMARK_KEY, mapping=mapping)
+
+
+def _record_fingerprint(record: Dict[str, Any]) -> str:
+    canonical = json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+async def _diff_fingerprints(records: List[Any], resend_all: bool) -> Dict[str, Any]:
+    """Split records into changed/unchanged against the last persisted fingerprints."""
+    ids = [str((x or {}).get("bmoRecordId") or "") for x in records]
+    keyed = [record_id for record_id in ids if record_id]
+    stored = dict(zip(keyed, await r.hmget(SYNC_FINGERPRINT_KEY, keyed))) if keyed else {}
+
+    changed = []
+    fingerprints: Dict[str, str] = {}
+    for record, record_id in zip(records, ids):
+        fingerprint = _record_fingerprint(record or {})
+        if resend_all or not record_id or fingerprint != stored.get(record_id):
+            changed.append(record)
+            if record_id:
+                fingerprints[record_id] = fingerprint
+    return {"list": changed, "fingerprints": fingerprints, "unchanged": len(records) - len(changed)}
+
+
+async def _post_persist(payload: Dict[str, Any]) -> Dict[str, Any]:
     headers = {
         "Content-Type": "application/json",
         "X-Internal-Token": CRAFTSYS_BMO_PERSIST_TOKEN,
     }
-    payload = {
-        "source": source,
-        "list": result.get("list") or [],
-        "traceId": result.get("traceId"),
-        "fetched": result.get("fetched"),
-        "total": result.get("total"),
-        "fetchedAt": result.get("fetchedAt"),
-    }
-    with httpx.Client(timeout=_norm_timeout_ms(BMO_SYNC_JOB_TIMEOUT_MS), verify=False) as c:
-        resp = c.post(CRAFTSYS_BMO_PERSIST_URL, headers=headers, json=payload)
-        text = resp.text
+    body = serde.dumps_bytes(payload)
+    if len(body) >= max(0, BMO_SYNC_PERSIST_GZIP_MIN_BYTES):
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    metrics.inc("bmo_relay_upload_bytes_total", len(body), target="craftsys")
+    resp = await bmo_http.apost(
+        CRAFTSYS_BMO_PERSIST_URL,
+        timeout=_norm_timeout_ms(BMO_SYNC_JOB_TIMEOUT_MS),
+        headers=headers,
+        content=body,
+    )
+    text = resp.text
+    try:
+        data = resp.json()
+    except Exception:
+        data = None
+    if resp.status_code >= 400:
+        message = (
+            (data or {}).get("message")
+            or (data or {}).get("detail")
+            or text
+            or f"persist HTTP {resp.status_code}"
+        )
+        raise RuntimeError(str(message)[:500])
+    return (data or {}).get("data") if isinstance(data, dict) else {}
+
+
+async def _persist_mould_list(meta: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, int]:
+    """POST one page's changed records in chunks, recording fingerprints as each chunk lands."""
+    changed = delta.get("list") or []
+    fingerprints = delta.get("fingerprints") or {}
+    size = max(1, BMO_SYNC_PERSIST_CHUNK_SIZE)
+    upserted = 0
+    chunks = 0
+    for start in range(0, len(changed), size):
+        chunk = changed[start : start + size]
+        data = await _post_persist({**meta, "list": chunk, "final": False}) or {}
+        upserted += int(data.get("upserted") or 0) if isinstance(data, dict) else 0
+        chunks += 1
+        # a failure later on only resends what did not land
+        chunk_prints = {
+            str(x.get("bmoRecordId")): fingerprints[str(x.get("bmoRecordId"))]
+            for x in chunk
+            if str((x or {}).get("bmoRecordId") or "") in fingerprints
+        }
+        if chunk_prints:
+            await r.hset(SYNC_FINGERPRINT_KEY, mapping=chunk_prints)
+    return {"upserted": upserted, "chunks": chunks}
+
+
+async def _mirror_call(fn: Any, *args: Any) -> Any:
+    """Run a blocking mirror call off the event loop; the mirror never fails a sync."""
+    if not mirror.BMO_MIRROR_ENABLED:
+        return None
+    try:
+        return await asyncio.to_thread(fn, *args)
+    except Exception as e:
+        return e
+
+
+async def _stream_sync(plan: Dict[str, Any], source: str, resend_all: bool) -> Dict[str, Any]:
+    """Run collect -> diff -> persist page by page and finish with a commit marker.
+
+    Collection runs as its own task and hands pages over through a bounded queue, so
+    persisting overlaps with fetching and at most a few pages are held in memory.
+    """
+    sync_id = uuid.uuid4().hex
+    pages: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=max(1, BMO_SYNC_PIPELINE_DEPTH))
+    finished = object()
+
+    async def _produce() -> None:
         try:
-            data = resp.json()
-        except Exception:
-            data = None
-        if resp.status_code >= 400:
-            message = (
-                (data or {}).get("message")
-                or (data or {}).get("detail")
-                or text
-                or f"persist HTTP {resp.status_code}"
-            )
-            raise RuntimeError(str(message)[:500])
-        return (data or {}).get("data") if isinstance(data, dict) else {}
-
-
-def _run_sync_once(trigger: str) -> Dict[str, Any]:
+            # aclosing: a cancelled producer shuts the page window down right away, not at GC
+            async with aclosing(
+                _iter_pages(max(1, BMO_SYNC_PAGE_SIZE), max(1, BMO_SYNC_MAX_PAGES), plan["query"])
+            ) as page_iter:
+                async for page in page_iter:
+                    await pages.put(page)
+            await pages.put(finished)
+        except Exception as e:
+            await pages.put(e)
+
+    meta = {"source": source, "mode": plan["mode"], "syncId": sync_id}
+    summary: Dict[str, Any] = {
+        "syncId": sync_id,
+        "fetched": 0,
+        "total": None,
+        "traceId": None,
+        "fetchedAt": None,
+        "watermark": None,
+        "changed": 0,
+        "unchanged": 0,
+        "upserted": 0,
+        "chunks": 0,
+        "mirrored": 0,
+        "mirrorError": None,
+        "duplicates": 0,
+    }
+    seen_ids = set()
+    # the largest total any page reported: rows deleted mid-sync shift later offsets and
+    # skip live rows, which only shows as the total shrinking under us
+    total_max = 0
+    producer = asyncio.create_task(_produce())
+    try:
+        while True:
+            page = await pages.get()
+            if page is finished:
+                break
+            if isinstance(page, Exception):
+                raise page
+            records = _page_list(page)
+            summary["fetched"] += len(records)
+            if page.get("traceId"):
+                summary["traceId"] = str(page.get("traceId"))
+            if page.get("fetchedAt"):
+                summary["fetchedAt"] = str(page.get("fetchedAt"))
+            try:
+                summary["total"] = int(page.get("total")) if page.get("total") is not None else summary["total"]
+            except Exception:
+                pass
+            total_max = max(total_max, summary["total"] or 0)
+            summary["watermark"] = _watermark_max(summary["watermark"], page.get("watermark"))
+            for record in records:
+                record_id = str((record or {}).get("bmoRecordId") or "")
+                if record_id in seen_ids:
+                    summary["duplicates"] += 1
+                elif record_id:
+                    seen_ids.add(record_id)
+            # the mirror takes every fetched record, not just the delta, so it can be rebuilt
+            mirrored = await _mirror_call(mirror.upsert, records, sync_id)
+            if isinstance(mirrored, Exception):
+                summary["mirrorError"] = str(mirrored)[:300]
+            elif mirrored:
+                summary["mirrored"] += mirrored
+            delta = await _diff_fingerprints(records, resend_all)
+            summary["changed"] += len(delta["list"])
+            summary["unchanged"] += delta["unchanged"]
+            if delta["list"]:
+                meta.update(traceId=summary["traceId"], fetchedAt=summary["fetchedAt"], total=summary["total"])
+                sent = await _persist_mould_list(meta, delta)
+                summary["upserted"] += sent["upserted"]
+                summary["chunks"] += sent["chunks"]
+    finally:
+        producer.cancel()
+        # wait for the page window to shut down before the sync reports back or releases its lock
+        await asyncio.gather(producer, return_exceptions=True)
+
+    if summary["total"] is None:
+        summary["total"] = summary["fetched"]
+    summary["fetchedAt"] = summary["fetchedAt"] or time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    # removals are only knowable from a full, uncapped listing that saw every record once;
+    # a row read twice means the offsets shifted mid-sync and some other row was skipped
+    removed: List[str] = []
+    if plan["mode"] == "full" and not summary["duplicates"] and len(seen_ids) >= max(total_max, summary["total"]):
+        removed = sorted(set(await r.hkeys(SYNC_FINGERPRINT_KEY) or []) - seen_ids)
+        if not summary["mirrorError"]:
+            pruned = await _mirror_call(mirror.prune, sync_id)
+            if isinstance(pruned, Exception):
+                summary["mirrorError"] = str(pruned)[:300]
+    summary["removed"] = 0
+    summary["committed"] = False
+    if summary["chunks"] or removed:
+        committed = await _post_persist(
+            {
+                **meta,
+                "list": [],
+                "final": True,
+                "removedIds": removed,
+                "fetched": summary["fetched"],
+                "total": summary["total"],
+                "traceId": summary["traceId"],
+                "fetchedAt": summary["fetchedAt"],
+                "changed": summary["changed"],
+                "unchanged": summary["unchanged"],
+                "upserted": summary["upserted"],
+            }
+        ) or {}
+        summary["removed"] = int(committed.get("removed") or 0) if isinstance(committed, dict) else 0
+        summary["committed"] = True
+        if removed:
+            await r.hdel(SYNC_FINGERPRINT_KEY, *removed)
+    summary["removedIds"] = len(removed)
+    return summary
+
+
+async def _run_sync_once(trigger: str, full: bool = False) -> Dict[str, Any]:
     if not _sync_ready():
         raise RuntimeError("sync 未启用：缺少 CRAFTSYS_BMO_PERSIST_URL 或 CRAFTSYS_BMO_PERSIST_TOKEN")
 
     lock_value = uuid.uuid4().hex
-    if not r.set(SYNC_LOCK_KEY, lock_value, nx=True, ex=max(60, BMO_SYNC_LOCK_TTL_SEC)):
-        current = _load_sync_status()
+    if not await r.set(SYNC_LOCK_KEY, lock_value, nx=True, ex=max(60, BMO_SYNC_LOCK_TTL_SEC)):
+        current = await _load_sync_status()
         return {"started": False, "skipped": True, "reason": "running", "status": current}
 
     started_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-    _save_sync_status(running="1", lastTrigger=trigger, lastStartedAt=started_at, lastError=None)
+    await _save_sync_status(running="1", lastTrigger=trigger, lastStartedAt=started_at, lastError=None)
+    started = time.perf_counter()
+    mode, result = ("full" if full else "incremental"), "error"
     try:
-        collected = _collect_all_pages(
-            max(1, BMO_SYNC_PAGE_SIZE),
-            max(1, BMO_SYNC_MAX_PAGES),
-        )
-        persisted = _persist_mould_list(collected, trigger)
+        plan = await _plan_sync(full)
+        mode = plan["mode"]
+        # a manual full sync resends everything so a wiped craftsys table can be re-seeded
+        collected = await _stream_sync(plan, trigger, resend_all=full)
+        persisted = {
+            "syncId": collected["syncId"],
+            "upserted": collected["upserted"],
+            "removed": collected["removed"],
+            "chunks": collected["chunks"],
+            "committed": collected["committed"],
+        }
+        await _advance_watermark(plan["mode"], collected)
+        watermark_warning = None
+        if BMO_SYNC_WATERMARK_FIELD and collected.get("fetched") and collected.get("watermark") in (None, ""):
+            # without a watermark every later run falls back to full; say so instead of hiding it
+            watermark_warning = f"BMO 列表记录中没有水位字段 {BMO_SYNC_WATERMARK_FIELD}，增量同步不可用，每次都按全量执行"
         finished_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-        status = _save_sync_status(
+        extra = {"lastFullAt": finished_at} if plan["mode"] == "full" else {}
+        status = await _save_sync_status(
+            **extra,
+            lastMode=plan["mode"],
             running="0",
             lastFinishedAt=finished_at,
             lastSuccessAt=finished_at,
             lastError=None,
             lastTraceId=collected.get("traceId"),
             lastFetched=collected.get("fetched"),
-            lastPersisted=(persisted or {}).get("upserted") if isinstance(persisted, dict) else None,
+            lastPersisted=collected["upserted"],
+            lastUnchanged=collected["unchanged"],
+            lastRemoved=collected["removedIds"],
             lastTotal=collected.get("total"),
+            lastMirrored=collected["mirrored"],
+            lastMirrorError=collected["mirrorError"],
+            lastDuplicates=collected["duplicates"],
+            lastWatermarkWarning=watermark_warning,
             lastPersistResponse=persisted,
         )
+        result = "success"
         return {
             "started": True,
             "skipped": False,
+            "mode": plan["mode"],
             "fetched": collected.get("fetched"),
+            "changed": collected["changed"],
+            "unchanged": collected["unchanged"],
+            "removed": collected["removedIds"],
             "total": collected.get("total"),
             "traceId": collected.get("traceId"),
             "persisted": persisted,
@@ -330,7 +822,7 @@ def _run_sync_once(trigger: str) -> Dict[str, Any]:
         }
     except Exception as e:
         finished_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-        _save_sync_status(
+        await _save_sync_status(
             running="0",
             lastFinishedAt=finished_at,
             lastErrorAt=finished_at,
@@ -338,49 +830,56 @@ def _run_sync_once(trigger: str) -> Dict[str, Any]:
         )
         raise
     finally:
-        current = str(r.get(SYNC_LOCK_KEY) or "")
+        metrics.observe("bmo_relay_sync_duration_seconds", time.perf_counter() - started, mode=mode, result=result)
+        current = str(await r.get(SYNC_LOCK_KEY) or "")
         if current == lock_value:
-            r.delete(SYNC_LOCK_KEY)
+            await r.delete(SYNC_LOCK_KEY)
 
 
-def _run_sync_background(trigger: str) -> None:
+async def _run_sync_background(trigger: str, full: bool = False) -> None:
     try:
-        _run_sync_once(trigger)
+        await _run_sync_once(trigger, full)
     except Exception:
         pass
 
 
-def _scheduler_loop() -> None:
+async def _scheduler_loop() -> None:
     delay_sec = max(1.0, BMO_SYNC_STARTUP_DELAY_MS / 1000.0)
     interval_sec = max(60.0, BMO_SYNC_INTERVAL_MS / 1000.0)
-    time.sleep(delay_sec)
+    await asyncio.sleep(delay_sec)
     while True:
         if _sync_ready():
-            trigger = str(r.get(SYNC_TRIGGER_KEY) or "").strip() or "scheduler"
-            if trigger != "scheduler":
-                r.delete(SYNC_TRIGGER_KEY)
             try:
-                _run_sync_once(trigger)
+                trigger = str(await r.get(SYNC_TRIGGER_KEY) or "").strip() or "scheduler"
+                if trigger != "scheduler":
+                    await r.delete(SYNC_TRIGGER_KEY)
+                await _run_sync_once(trigger)
             except Exception:
                 pass
-        time.sleep(interval_sec)
+        await asyncio.sleep(interval_sec)
 
 
 @app.on_event("startup")
-def startup_sync_scheduler():
-    global _scheduler_started
-    with _scheduler_guard:
-        if _scheduler_started:
-            return
-        _scheduler_started = True
-    _save_sync_status(
+async def startup_sync_scheduler():
+    global _scheduler_task
+    if _scheduler_task is not None:
+        return
+    await _save_sync_status(
         running="0",
         lastTrigger=None,
         lastStartedAt=None,
         lastFinishedAt=None,
     )
-    thread = threading.Thread(target=_scheduler_loop, name="bmo-sync-scheduler", daemon=True)
-    thread.start()
+    _scheduler_task = asyncio.create_task(_scheduler_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_clients():
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()
+    await bmo_http.aclose()
+    await r.aclose()
+    await rb.aclose()
 
 
 def _mask_secret(raw: str, keep: int = 8) -> str:
@@ -416,7 +915,7 @@ def _encrypt_password(password: str, pubkey_base64: str) -> str:
     return __import__("base64").b64encode(encrypted).decode("ascii")
 
 
-def _probe_auth(cookie: str, token: str) -> Dict[str, Any]:
+async def _probe_auth(cookie: str, token: str) -> Dict[str, Any]:
     headers = {
         "Content-Type": "application/json;charset=UTF-8",
         "Accept": "application/json, text/plain, */*",
@@ -436,12 +935,12 @@ def _probe_auth(cookie: str, token: str) -> Dict[str, Any]:
         "offset": 0,
         "params": {},
     }
-    with httpx.Client(timeout=_norm_timeout_ms(12000), verify=False) as c:
-        resp = c.post(
-            f"{BMO_BASE_URL}/data/sys-modeling/sysModelingMain/data",
-            headers=headers,
-            json=payload,
-        )
+    resp = await bmo_http.apost(
+        f"{BMO_BASE_URL}/data/sys-modeling/sysModelingMain/data",
+        timeout=_norm_timeout_ms(12000),
+        headers=headers,
+        json=payload,
+    )
     ok = resp.status_code < 400
     msg = ""
     if not ok:
@@ -460,7 +959,7 @@ def _probe_auth(cookie: str, token: str) -> Dict[str, Any]:
     return {"ok": ok, "status": resp.status_code, "message": msg}
 
 
-def _refresh_auth_via_api(username: str, password: str) -> Dict[str, Any]:
+async def _refresh_auth_via_api(username: str, password: str) -> Dict[str, Any]:
     headers = {
         "Content-Type": "application/json;charset=UTF-8",
         "x-need-pkey": "RSA",
@@ -470,72 +969,189 @@ def _refresh_auth_via_api(username: str, password: str) -> Dict[str, Any]:
         "Origin": BMO_BASE_URL,
         "Referer": f"{BMO_BASE_URL}/web/",
     }
-    with httpx.Client(timeout=_norm_timeout_ms(15000), verify=False) as c:
-        pub_resp = c.post(
-            f"{BMO_BASE_URL}{BMO_LOGIN_PAGE_ENDPOINT}",
-            headers=headers,
-            json={"fdClient": 1},
-        )
-        if pub_resp.status_code >= 400:
-            raise RuntimeError(f"获取公钥失败 HTTP {pub_resp.status_code}")
-        pubkey = pub_resp.headers.get("x-pubkey", "")
-        if not pubkey:
-            raise RuntimeError("获取公钥失败：未返回 x-pubkey")
-        enc_pwd = _encrypt_password(password, pubkey)
-
-        login_headers = {
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Accept": "application/json, text/plain, */*",
-            "X-Accept-Language": "zh-CN",
-            "Accept-Language": "zh-CN,zh;q=0.9",
-            "Origin": BMO_BASE_URL,
-            "Referer": f"{BMO_BASE_URL}/web/",
-        }
-        login_resp = c.post(
-            f"{BMO_BASE_URL}{BMO_LOGIN_ENDPOINT}",
-            headers=login_headers,
-            content=urlencode({"j_username": username, "j_password": enc_pwd}),
-        )
-        login_text = login_resp.text
-        login_json: Dict[str, Any] = {}
-        try:
-            login_json = login_resp.json()
-        except Exception:
-            login_json = {}
-        if login_resp.status_code >= 400 or login_json.get("success") is False:
-            msg = login_json.get("msg") or login_json.get("message") or login_text[:180]
-            raise RuntimeError(str(msg or "登录失败"))
-        cookie = _cookie_header_from_set_cookie(login_resp.headers.get_list("set-cookie"))
-        token = (
-            login_resp.headers.get("x-auth-token")
-            or ((login_json.get("data") or {}).get("token") if isinstance(login_json.get("data"), dict) else "")
-            or login_json.get("token")
-            or ""
-        )
-        token = str(token or "").strip()
-        if token and "X-AUTH-TOKEN=" not in cookie:
-            cookie = f"{cookie}; X-AUTH-TOKEN={token}" if cookie else f"X-AUTH-TOKEN={token}"
-        if not cookie and not token:
-            raise RuntimeError("登录成功但未返回 Cookie/Token")
-        return {"cookie": cookie, "token": token}
+    timeout = _norm_timeout_ms(15000)
+    pub_resp = await bmo_http.apost(
+        f"{BMO_BASE_URL}{BMO_LOGIN_PAGE_ENDPOINT}",
+        timeout=timeout,
+        headers=headers,
+        json={"fdClient": 1},
+    )
+    if pub_resp.status_code >= 400:
+        raise RuntimeError(f"获取公钥失败 HTTP {pub_resp.status_code}")
+    pubkey = pub_resp.headers.get("x-pubkey", "")
+    if not pubkey:
+        raise RuntimeError("获取公钥失败：未返回 x-pubkey")
+    enc_pwd = _encrypt_password(password, pubkey)
+
+    login_headers = {
+        "Content-Type": "application/x-www-form-urlencoded",
+        "Accept": "application/json, text/plain, */*",
+        "X-Accept-Language": "zh-CN",
+        "Accept-Language": "zh-CN,zh;q=0.9",
+        "Origin": BMO_BASE_URL,
+        "Referer": f"{BMO_BASE_URL}/web/",
+    }
+    # the pooled client keeps no cookie jar, so carry the login-page session over by hand
+    page_cookie = _cookie_header_from_set_cookie(pub_resp.headers.get_list("set-cookie"))
+    if page_cookie:
+        login_headers["Cookie"] = page_cookie
+    login_resp = await bmo_http.apost(
+        f"{BMO_BASE_URL}{BMO_LOGIN_ENDPOINT}",
+        timeout=timeout,
+        headers=login_headers,
+        content=urlencode({"j_username": username, "j_password": enc_pwd}),
+    )
+    login_text = login_resp.text
+    login_json: Dict[str, Any] = {}
+    try:
+        login_json = login_resp.json()
+    except Exception:
+        login_json = {}
+    if login_resp.status_code >= 400 or login_json.get("success") is False:
+        msg = login_json.get("msg") or login_json.get("message") or login_text[:180]
+        raise RuntimeError(str(msg or "登录失败"))
+    cookie = _cookie_header_from_set_cookie(login_resp.headers.get_list("set-cookie"))
+    token = (
+        login_resp.headers.get("x-auth-token")
+        or ((login_json.get("data") or {}).get("token") if isinstance(login_json.get("data"), dict) else "")
+        or login_json.get("token")
+        or ""
+    )
+    token = str(token or "").strip()
+    if token and "X-AUTH-TOKEN=" not in cookie:
+        cookie = f"{cookie}; X-AUTH-TOKEN={token}" if cookie else f"X-AUTH-TOKEN={token}"
+    if not cookie and not token:
+        raise RuntimeError("登录成功但未返回 Cookie/Token")
+    return {"cookie": cookie, "token": token}
 
 
 @app.get("/health")
-def health():
+async def health():
     try:
-        pong = r.ping()
+        pong = await r.ping()
     except Exception as e:
         return {"ok": False, "ready": False, "error": str(e)}
     return {"ok": True, "ready": bool(pong), "error": ""}
 
 
+@app.get("/http/stats")
+async def http_stats():
+    workers = {}
+    async for key in r.scan_iter(match=f"{HTTP_STATS_KEY_PREFIX}worker:*"):
+        worker_id = key[len(f"{HTTP_STATS_KEY_PREFIX}worker:"):]
+        workers[worker_id] = {k: json_or_text(v) for k, v in (await r.hgetall(key) or {}).items()}
+    return {"code": 0, "success": True, "data": {"api": bmo_http.stats(), "workers": workers}}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape target for the API and every worker publishing to Redis."""
+    snapshots = [metrics.snapshot()]
+    worker_keys = [key async for key in r.scan_iter(match=f"{metrics.METRICS_KEY_PREFIX}worker:*")]
+    pipe = r.pipeline(transaction=False)
+    for key in worker_keys:
+        pipe.get(key)
+    for lane in jobqueue.LANES:
+        pipe.llen(jobqueue.lane_key(lane))
+    pipe.zcard(jobqueue.PROCESSING_KEY)
+    pipe.hgetall(collectcache.STATS_KEY)
+    out = await pipe.execute()
+    reporting = 0
+    for raw in out[: len(worker_keys)]:
+        try:
+            snapshots.append(serde.loads(raw))
+            reporting += 1
+        except Exception:
+            continue  # expired between SCAN and GET, or a partial write
+    depths = out[len(worker_keys) : len(worker_keys) + len(jobqueue.LANES)]
+    processing, cache_raw = out[-2], out[-1] or {}
+    # the collect cache counts in a shared hash already, so it joins the sum as one more snapshot
+    snapshots.append(
+        {
+            "counters": [
+                ["bmo_relay_collect_cache_events_total", {"event": name}, int(cache_raw.get(name) or 0)]
+                for name in collectcache.STAT_FIELDS
+            ]
+        }
+    )
+    gauges = [
+        ("bmo_relay_queue_depth", "Jobs waiting in each queue lane.", {"lane": lane}, int(depth or 0))
+        for lane, depth in zip(jobqueue.LANES, depths)
+    ]
+    gauges.append(("bmo_relay_jobs_processing", "Jobs currently leased to a worker.", {}, int(processing or 0)))
+    gauges.append(("bmo_relay_metrics_workers_reporting", "Workers whose metrics snapshot is live.", {}, reporting))
+    return PlainTextResponse(metrics.render(snapshots, gauges), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/moulds/search")
+async def search_moulds(q: str = "", limit: int = 10, fields: Optional[str] = None):
+    """Typeahead over mould number, part number and part name in the local mirror."""
+    if not mirror.BMO_MIRROR_ENABLED:
+        raise HTTPException(status_code=503, detail="mould mirror is disabled")
+    projection = [x.strip() for x in str(fields or "").split(",") if x.strip()] or None
+    found = await asyncio.to_thread(mirror.search, q, limit, projection)
+    return RelayJSONResponse({"code": 0, "success": True, "data": found})
+
+
+# reserved /moulds query params; every other param is a filter `<field>` or `<field>.<op>`
+_MOULDS_RESERVED = {"sort", "limit", "after", "fields", "withTotal"}
+
+
+@app.get("/moulds")
+async def list_moulds(
+    request: Request,
+    sort: str = "bmoRecordId",
+    limit: int = 50,
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    withTotal: int = 0,
+):
+    """Query the local mirror the sync maintains; never calls BMO.
+
+    `?supplier=A&supplier=B&bidTime.gte=2025-01-01&sort=-bidTime&fields=moldNumber,supplier`
+    Repeating a plain `<field>` matches any of the values; page on with `after=<nextCursor>`.
+    """
+    if not mirror.BMO_MIRROR_ENABLED:
+        raise HTTPException(status_code=503, detail="mould mirror is disabled")
+    grouped: Dict[Tuple[str, str], List[str]] = {}
+    for key, value in request.query_params.multi_items():
+        if key in _MOULDS_RESERVED:
+            continue
+        field, _, op = key.partition(".")
+        grouped.setdefault((field, op or "eq"), []).append(value)
+    filters = []
+    for (field, op), values in grouped.items():
+        if op == "eq" and len(values) > 1:
+            filters.append((field, "in", values))
+        else:
+            filters.extend((field, op, value) for value in values)
+    projection = [x.strip() for x in str(fields or "").split(",") if x.strip()] or None
+    try:
+        page, meta = await asyncio.gather(
+            asyncio.to_thread(mirror.query, filters, sort, limit, after, projection, bool(withTotal)),
+            asyncio.to_thread(mirror.stats),
+        )
+    except mirror.MirrorQueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return RelayJSONResponse({"code": 0, "success": True, "data": {**page, "mirror": meta}})
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    pipe = r.pipeline(transaction=False)
+    pipe.hgetall(collectcache.STATS_KEY)
+    pipe.get(collectcache.GENERATION_KEY)
+    raw, generation = await pipe.execute()
+    return {"code": 0, "success": True, "data": collectcache.read_stats(raw or {}, int(generation or 0))}
+
+
 @app.get("/sync/status")
-def sync_status():
-    return {"code": 0, "success": True, "data": _load_sync_status()}
+async def sync_status():
+    return {"code": 0, "success": True, "data": await _load_sync_status()}
 
 
 @app.post("/sync/run")
-def sync_run(body: SyncRunBody):
+async def sync_run(body: SyncRunBody):
     trigger = str(body.trigger or "manual").strip() or "manual"
     wait_ms = int(body.waitMs or 0)
     if not _sync_ready():
@@ -543,28 +1159,29 @@ def sync_run(body: SyncRunBody):
 
     if wait_ms > 0:
         try:
-            data = _run_sync_once(trigger)
+            data = await _run_sync_once(trigger, bool(body.full))
             return {"code": 0, "success": True, "data": data}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e)[:300])
 
-    current = _load_sync_status()
+    current = await _load_sync_status()
     if current.get("running"):
         return {"code": 0, "success": True, "data": {"started": False, "status": current}}
 
-    r.set(SYNC_TRIGGER_KEY, trigger, ex=max(60, int(BMO_SYNC_INTERVAL_MS / 1000) or 60))
-    thread = threading.Thread(target=_run_sync_background, args=(trigger,), daemon=True)
-    thread.start()
+    await r.set(SYNC_TRIGGER_KEY, trigger, ex=max(60, int(BMO_SYNC_INTERVAL_MS / 1000) or 60))
+    task = asyncio.create_task(_run_sync_background(trigger, bool(body.full)))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
     return {
         "code": 0,
         "success": True,
-        "data": {"started": True, "trigger": trigger, "status": _load_sync_status()},
+        "data": {"started": True, "trigger": trigger, "status": await _load_sync_status()},
     }
 
 
 @app.get("/auth/status")
-def auth_status(probe: int = 0):
-    st = _load_auth_state()
+async def auth_status(probe: int = 0):
+    st = await _load_auth_state()
     cookie = st.get("cookie") or ""
     token = st.get("token") or ""
     data: Dict[str, Any] = {
@@ -576,36 +1193,36 @@ def auth_status(probe: int = 0):
         "tokenPreview": _mask_secret(token, 12) if token else "",
     }
     if int(probe or 0) == 1:
-        data["probe"] = _probe_auth(cookie, token)
+        data["probe"] = await _probe_auth(cookie, token)
     return {"code": 0, "success": True, "data": data}
 
 
 @app.post("/auth/set")
-def auth_set(body: AuthSetBody):
+async def auth_set(body: AuthSetBody):
     cookie = str(body.cookie or "").strip()
     token = str(body.token or "").strip()
-    _save_auth_state(cookie, token, "manual-set")
+    await _save_auth_state(cookie, token, "manual-set")
     return {"code": 0, "success": True, "data": {"hasCookie": bool(cookie), "hasToken": bool(token)}}
 
 
 @app.post("/auth/logout")
-def auth_logout():
-    _save_auth_state("", "", "manual-logout")
+async def auth_logout():
+    await _save_auth_state("", "", "manual-logout")
     return {"code": 0, "success": True, "data": {"loggedOut": True}}
 
 
 @app.post("/auth/login")
-def auth_login(body: AuthLoginBody):
+async def auth_login(body: AuthLoginBody):
     username = str(body.username or os.environ.get("BMO_USERNAME") or "").strip()
     password = str(body.password or os.environ.get("BMO_PASSWORD") or "").strip()
     if not username or not password:
         raise HTTPException(status_code=400, detail="缺少用户名或密码")
     try:
-        refreshed = _refresh_auth_via_api(username, password)
+        refreshed = await _refresh_auth_via_api(username, password)
         cookie = str(refreshed.get("cookie") or "")
         token = str(refreshed.get("token") or "")
-        _save_auth_state(cookie, token, "manual-login")
-        probe = _probe_auth(cookie, token)
+        await _save_auth_state(cookie, token, "manual-login")
+        probe = await _probe_auth(cookie, token)
         return {
             "code": 0,
             "success": True,
@@ -619,51 +1236,98 @@ def auth_login(body: AuthLoginBody):
         raise HTTPException(status_code=500, detail=f"登录失败: {str(e)[:220]}")
 
 
-@app.post("/jobs")
-def create_job(body: JobCreate):
-    if body.type not in {"collect", "download_attachment", "writeback", "upload_attachment"}:
+def _validate_job_spec(body: JobCreate, default_priority: Optional[str] = None) -> Dict[str, Any]:
+    if body.type not in JOB_TYPES:
         raise HTTPException(status_code=400, detail="unsupported job type")
+    priority = jobqueue.normalize_lane(body.priority or default_priority)
+    if priority is None:
+        raise HTTPException(status_code=400, detail=f"unsupported priority, expected one of {list(jobqueue.LANES)}")
+    return {"type": body.type, "payload": body.payload, "priority": priority, "force": bool(body.force)}
 
-    job_id = f"job_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
-    now = int(time.time())
-    data = {
-        "id": job_id,
-        "type": body.type,
-        "status": "queued",
-        "payload": json.dumps(body.payload, ensure_ascii=False),
-        "created_at": str(now),
-        "started_at": "",
-        "finished_at": "",
-        "error": "",
-        "result": "",
+
+@app.post("/jobs")
+async def create_job(body: JobCreate):
+    created = await _enqueue_jobs([_validate_job_spec(body)])
+    return {"code": 0, "success": True, "data": created[0]}
+
+
+@app.post("/jobs/batch")
+async def create_jobs_batch(body: JobBatchCreate):
+    if not body.jobs:
+        raise HTTPException(status_code=400, detail="jobs is empty")
+    if len(body.jobs) > max(1, JOB_BATCH_MAX):
+        raise HTTPException(status_code=400, detail=f"too many jobs, at most {JOB_BATCH_MAX} per batch")
+    specs = []
+    for index, item in enumerate(body.jobs):
+        # validate everything before writing anything: a batch is all-or-nothing
+        try:
+            specs.append(_validate_job_spec(item, body.priority))
+        except HTTPException as e:
+            raise HTTPException(status_code=400, detail=f"jobs[{index}]: {e.detail}")
+    created = await _enqueue_jobs(specs)
+    return {
+        "code": 0,
+        "success": True,
+        "data": {"count": len(created), "ids": [x["id"] for x in created], "jobs": created},
     }
-    r.hset(job_key(job_id), mapping=data)
-    r.rpush(QUEUE_KEY, job_id)
-    return {"code": 0, "success": True, "data": normalize_job(data)}
 
 
 @app.get("/jobs/{job_id}")
-def get_job(job_id: str):
-    data = r.hgetall(job_key(job_id))
+async def get_job(job_id: str, includeResult: int = 1, waitMs: int = 0):
+    data = await r.hgetall(job_key(job_id))
+    if not data:
+        raise HTTPException(status_code=404, detail="job not found")
+    state = str(data.get("status") or "").strip().lower()
+    if waitMs > 0 and state not in jobqueue.TERMINAL_STATES:
+        # long-poll: answer as soon as the job finishes, or with its current state on timeout
+        timeout_sec = min(waitMs, max(0, JOB_WAIT_MAX_MS)) / 1000.0
+        data = await jobqueue.wait_for_terminal_async(r, job_id, timeout_sec) or await r.hgetall(job_key(job_id)) or data
+    return RelayJSONResponse({"code": 0, "success": True, "data": await _job_view(data, include_result=bool(includeResult))})
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, timeoutMs: int = 0):
+    if not await r.exists(job_key(job_id)):
+        raise HTTPException(status_code=404, detail="job not found")
+    limit_ms = max(0, JOB_EVENTS_MAX_MS)
+    timeout_sec = (min(timeoutMs, limit_ms) if timeoutMs > 0 else limit_ms) / 1000.0
+
+    async def _stream():
+        async for data in jobqueue.watch_job_async(r, job_id, timeout_sec):
+            if data is None:
+                yield ": keep-alive\n\n"
+                continue
+            state = str(data.get("status") or "").strip().lower()
+            job = await _job_view(data, include_result=state in jobqueue.TERMINAL_STATES)
+            yield f"event: {state or 'unknown'}\ndata: {serde.dumps(job)}\n\n"
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    data = await r.hgetall(job_key(job_id))
     if not data:
         raise HTTPException(status_code=404, detail="job not found")
-    return {"code": 0, "success": True, "data": normalize_job(data)}
+    return RelayJSONResponse({"code": 0, "success": True, "data": await jobqueue.load_result_async(rb, data)})
 
 
 @app.post("/jobs/{job_id}/retry")
-def retry_job(job_id: str):
-    data = r.hgetall(job_key(job_id))
+async def retry_job(job_id: str):
+    data = await r.hgetall(job_key(job_id))
     if not data:
         raise HTTPException(status_code=404, detail="job not found")
-    r.hset(job_key(job_id), mapping={"status": "queued", "error": "", "finished_at": "", "result": ""})
-    r.rpush(QUEUE_KEY, job_id)
+    await jobqueue.requeue_async(r, job_id)
     return {"code": 0, "success": True, "data": {"id": job_id, "status": "queued"}}
 
 
 @app.get("/files/{file_id}")
-def download_file(file_id: str):
-    clean_id = os.path.basename(file_id)
-    path = os.path.join(FILES_DIR, clean_id)
-    if not os.path.exists(path):
+async def download_file(file_id: str):
+    path, download_name = filestore.resolve_file_id(file_id)
+    if not path.is_file():
         raise HTTPException(status_code=404, detail="file not found")
-    return FileResponse(path, filename=clean_id)
+    return FileResponse(str(path), filename=download_name)
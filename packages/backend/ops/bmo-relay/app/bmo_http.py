@@ -0,0 +1,178 @@
+import http.cookiejar
+import importlib.util
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+
+BMO_HTTP2 = str(os.environ.get('BMO_HTTP2', '0')).strip().lower() in {'1', 'true', 'yes'}
+BMO_HTTP_MAX_CONNECTIONS = int(os.environ.get('BMO_HTTP_MAX_CONNECTIONS', '20'))
+BMO_HTTP_MAX_KEEPALIVE = int(os.environ.get('BMO_HTTP_MAX_KEEPALIVE', '10'))
+BMO_HTTP_KEEPALIVE_EXPIRY_SEC = float(os.environ.get('BMO_HTTP_KEEPALIVE_EXPIRY_SEC', '30'))
+
+_client: Optional[httpx.Client] = None
+# the API service runs on asyncio and gets its own pool; the worker stays on the sync one
+_async_client: Optional[httpx.AsyncClient] = None
+_client_guard = threading.Lock()
+_stats_lock = threading.Lock()
+_STATS = {
+    'requests': 0,
+    'connectionsOpened': 0,
+    'tlsHandshakes': 0,
+}
+
+
+def http2_enabled() -> bool:
+    # http2 needs the optional `h2` package; fall back to HTTP/1.1 keep-alive without it
+    return BMO_HTTP2 and importlib.util.find_spec('h2') is not None
+
+
+def _no_cookie_jar() -> http.cookiejar.CookieJar:
+    # auth is always sent explicitly; a shared jar would leak Set-Cookie across sessions
+    return http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max(1, BMO_HTTP_MAX_CONNECTIONS),
+        max_keepalive_connections=max(0, BMO_HTTP_MAX_KEEPALIVE),
+        keepalive_expiry=max(1.0, BMO_HTTP_KEEPALIVE_EXPIRY_SEC),
+    )
+
+
+def get_client() -> httpx.Client:
+    """Process-wide pooled client, reused for every upstream call."""
+    global _client
+    if _client is None:
+        with _client_guard:
+            if _client is None:
+                _client = httpx.Client(
+                    verify=False,
+                    http2=http2_enabled(),
+                    cookies=_no_cookie_jar(),
+                    limits=_limits(),
+                )
+    return _client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            verify=False,
+            http2=http2_enabled(),
+            cookies=_no_cookie_jar(),
+            limits=_limits(),
+        )
+    return _async_client
+
+
+async def aclose() -> None:
+    global _async_client
+    if _async_client is not None:
+        client, _async_client = _async_client, None
+        await client.aclose()
+
+
+# path marker -> endpoint label for the upstream latency metrics; anything else is "other"
+_ENDPOINTS = (
+    ('/sysModelingMain/data', 'data'),
+    ('/sysModelingMain/view', 'view'),
+    ('/sys-attach/checkDownload/', 'checkDownload'),
+    ('/sys-attach/download/', 'download'),
+    ('/sys-auth/login', 'login'),
+    ('/loginPage', 'loginPage'),
+    ('persist-mould', 'persist'),
+)
+
+
+def endpoint_label(url: str) -> str:
+    path = urlsplit(url).path
+    return next((label for marker, label in _ENDPOINTS if marker in path), 'other')
+
+
+def _observe(url: str, started: float, status: str) -> None:
+    endpoint = endpoint_label(url)
+    metrics.observe('bmo_relay_upstream_request_duration_seconds', time.perf_counter() - started, endpoint=endpoint)
+    metrics.inc('bmo_relay_upstream_responses_total', endpoint=endpoint, code=status)
+
+
+def _bump(name: str) -> None:
+    with _stats_lock:
+        _STATS[name] += 1
+
+
+def _trace(event_name: str, info: Dict[str, Any]) -> None:
+    if event_name == 'connection.connect_tcp.complete':
+        _bump('connectionsOpened')
+    elif event_name == 'connection.start_tls.complete':
+        _bump('tlsHandshakes')
+
+
+async def _atrace(event_name: str, info: Dict[str, Any]) -> None:
+    _trace(event_name, info)
+
+
+def request(method: str, url: str, *, timeout: float, **kwargs: Any) -> httpx.Response:
+    _bump('requests')
+    started = time.perf_counter()
+    try:
+        resp = get_client().request(method, url, timeout=timeout, extensions={'trace': _trace}, **kwargs)
+    except Exception:
+        _observe(url, started, 'error')
+        raise
+    _observe(url, started, str(resp.status_code))
+    return resp
+
+
+@contextmanager
+def stream(method: str, url: str, *, timeout: float, **kwargs: Any) -> Iterator[httpx.Response]:
+    _bump('requests')
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        try:
+            resp = stack.enter_context(
+                get_client().stream(method, url, timeout=timeout, extensions={'trace': _trace}, **kwargs)
+            )
+        except Exception:
+            _observe(url, started, 'error')
+            raise
+        # latency is time to headers; the body is streamed (and counted in bytes) by the caller
+        _observe(url, started, str(resp.status_code))
+        yield resp
+
+
+def post(url: str, *, timeout: float, **kwargs: Any) -> httpx.Response:
+    return request('POST', url, timeout=timeout, **kwargs)
+
+
+async def arequest(method: str, url: str, *, timeout: float, **kwargs: Any) -> httpx.Response:
+    _bump('requests')
+    started = time.perf_counter()
+    try:
+        resp = await get_async_client().request(method, url, timeout=timeout, extensions={'trace': _atrace}, **kwargs)
+    except Exception:
+        _observe(url, started, 'error')
+        raise
+    _observe(url, started, str(resp.status_code))
+    return resp
+
+
+async def apost(url: str, *, timeout: float, **kwargs: Any) -> httpx.Response:
+    return await arequest('POST', url, timeout=timeout, **kwargs)
+
+
+def stats() -> Dict[str, Any]:
+    with _stats_lock:
+        snapshot = dict(_STATS)
+    snapshot['connectionsReused'] = max(0, snapshot['requests'] - snapshot['connectionsOpened'])
+    snapshot['http2'] = http2_enabled()
+    snapshot['maxConnections'] = BMO_HTTP_MAX_CONNECTIONS
+    snapshot['maxKeepalive'] = BMO_HTTP_MAX_KEEPALIVE
+    return snapshot
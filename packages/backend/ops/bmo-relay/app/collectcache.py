@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+import serde
+
+# mapped collect pages are cached in Redis, shared by the API (reads) and the workers
+# (writes); a page is served as-is for COLLECT_CACHE_TTL_SEC and for COLLECT_CACHE_STALE_SEC
+# after that it is still served while one background collect refreshes it
+COLLECT_CACHE_TTL_SEC = int(os.environ.get('COLLECT_CACHE_TTL_SEC', '300'))
+COLLECT_CACHE_STALE_SEC = int(os.environ.get('COLLECT_CACHE_STALE_SEC', '3600'))
+CACHE_KEY_PREFIX = os.environ.get('COLLECT_CACHE_REDIS_PREFIX', 'bmo:collect:cache:')
+# bumped by every successful writeback; entries stored under an older generation are misses
+GENERATION_KEY = f'{CACHE_KEY_PREFIX}generation'
+STATS_KEY = f'{CACHE_KEY_PREFIX}stats'
+STAT_FIELDS = ('hits', 'staleHits', 'misses', 'refreshes', 'stores', 'invalidations')
+
+DEFAULT_SORTS = {'fd_create_time': 'desc'}
+
+
+def enabled() -> bool:
+    return COLLECT_CACHE_TTL_SEC > 0
+
+
+def normalize_query(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """The BMO list query a collect payload resolves to, with run_collect's defaults applied."""
+    sorts = payload.get('sorts')
+    conditions = payload.get('conditions')
+    params = payload.get('params')
+    return {
+        'pageSize': int(payload.get('pageSize') or 50),
+        'offset': int(payload.get('offset') or 0),
+        'sorts': sorts if isinstance(sorts, dict) else dict(DEFAULT_SORTS),
+        'conditions': conditions if isinstance(conditions, dict) else {},
+        'params': params if isinstance(params, dict) else {},
+    }
+
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    # key order and omitted defaults must not split one page across entries
+    canonical = json.dumps(normalize_query(payload), sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return CACHE_KEY_PREFIX + hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def generation(client: Any) -> int:
+    return int(client.get(GENERATION_KEY) or 0)
+
+
+def store(client: Any, payload: Dict[str, Any], result: Any, generation_seen: int) -> None:
+    """Cache a collect result under the generation read before the upstream fetch started.
+
+    A writeback that lands mid-fetch bumps the generation, so the page it may have
+    missed is never served as current.
+    """
+    if not enabled():
+        return
+    raw = serde.dumps_bytes(result)
+    pipe = client.pipeline(transaction=False)
+    key = cache_key(payload)
+    pipe.hset(
+        key,
+        mapping={
+            'generation': str(generation_seen),
+            'stored_at_ms': str(int(time.time() * 1000)),
+            'bytes': str(len(raw)),
+            'body': zlib.compress(raw, 6),
+        },
+    )
+    pipe.expire(key, COLLECT_CACHE_TTL_SEC + max(0, COLLECT_CACHE_STALE_SEC))
+    pipe.hincrby(STATS_KEY, 'stores', 1)
+    pipe.execute()
+
+
+def invalidate(client: Any) -> int:
+    pipe = client.pipeline(transaction=False)
+    pipe.incr(GENERATION_KEY)
+    pipe.hincrby(STATS_KEY, 'invalidations', 1)
+    return int(pipe.execute()[0])
+
+
+def classify(entry: List[Optional[bytes]], current_generation: int, now_ms: int) -> Optional[Dict[str, Any]]:
+    """Turn an HMGET of (generation, stored_at_ms, bytes, body) into a fresh/stale hit, or None."""
+    gen, stored_at, size, body = entry
+    if body is None or int(gen or -1) != current_generation:
+        return None
+    age_ms = max(0, now_ms - int(stored_at or 0))
+    if age_ms <= COLLECT_CACHE_TTL_SEC * 1000:
+        state = 'hit'
+    elif age_ms <= (COLLECT_CACHE_TTL_SEC + max(0, COLLECT_CACHE_STALE_SEC)) * 1000:
+        state = 'stale'
+    else:
+        return None
+    return {'state': state, 'ageMs': age_ms, 'bytes': int(size or 0), 'body': body}
+
+
+def read_stats(raw: Dict[str, str], current_generation: int) -> Dict[str, Any]:
+    counters = {name: int(raw.get(name) or 0) for name in STAT_FIELDS}
+    lookups = counters['hits'] + counters['staleHits'] + counters['misses']
+    return {
+        'enabled': enabled(),
+        'ttlSec': COLLECT_CACHE_TTL_SEC,
+        'staleSec': COLLECT_CACHE_STALE_SEC,
+        'generation': current_generation,
+        **counters,
+        'hitRatio': round((counters['hits'] + counters['staleHits']) / lookups, 4) if lookups else None,
+    }
@@ -0,0 +1,45 @@
+import os
+import re
+from pathlib import Path
+from typing import Tuple
+
+FILES_DIR = os.environ.get('FILES_DIR', '/data/files')
+
+# content-addressed file ids look like `<sha256>_<display name>`; the blob itself is
+# stored once under cas/<2-char prefix>/<sha256> no matter how many names point at it
+_CAS_FILE_ID = re.compile(r'^([0-9a-f]{64})_(.+)$')
+
+
+def safe_file_name(name: str, fallback: str) -> str:
+    return ''.join(ch if ch not in '\\/:*?"<>|\r\n' else '_' for ch in str(name or '')) or fallback
+
+
+def tmp_dir() -> Path:
+    path = Path(FILES_DIR) / '.tmp'
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def cas_path(sha256: str) -> Path:
+    return Path(FILES_DIR) / 'cas' / sha256[:2] / sha256
+
+
+def cas_file_id(sha256: str, file_name: str) -> str:
+    return f'{sha256}_{file_name}'
+
+
+def resolve_file_id(file_id: str) -> Tuple[Path, str]:
+    """Map a fileId to (path on disk, download name); legacy flat ids still resolve."""
+    clean_id = os.path.basename(str(file_id or ''))
+    matched = _CAS_FILE_ID.match(clean_id)
+    if matched:
+        return cas_path(matched.group(1)), matched.group(2)
+    return Path(FILES_DIR) / clean_id, clean_id
+
+
+def touch(path: Path) -> None:
+    # cleanup-files.sh expires by mtime, so a cache hit keeps the blob alive
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
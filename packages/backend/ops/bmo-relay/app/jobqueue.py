@@ -0,0 +1,568 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import redis
+import redis.asyncio
+
+import serde
+
+QUEUE_KEY = os.environ.get('JOB_QUEUE_KEY', 'bmo_relay_jobs')
+PROCESSING_KEY = f'{QUEUE_KEY}:processing'
+# one token per enqueued job; idle workers BLPOP it to wake up without polling every lane
+SIGNAL_KEY = f'{QUEUE_KEY}:signal'
+# every arrival is also published (job type, or '' when unknown) on a channel of the same name
+# (channels and keys do not collide); a worker whose queued work is all of types at their cap
+# sleeps on these instead of polling the lanes
+ARRIVALS_CHANNEL = SIGNAL_KEY
+SIGNAL_MAX = 10000
+JOB_KEY_PREFIX = 'bmo:job:'
+JOB_LEASE_SEC = int(os.environ.get('WORKER_JOB_LEASE_SEC', '60'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('WORKER_JOB_MAX_ATTEMPTS', '3'))
+CLAIM_SCAN_LIMIT = int(os.environ.get('WORKER_CLAIM_SCAN_LIMIT', '100'))
+# finished jobs (and their offloaded results) expire instead of growing Redis/AOF forever
+JOB_TTL_SEC = int(os.environ.get('JOB_TTL_SEC', str(7 * 24 * 3600)))
+# results larger than this leave the job hash and are stored zlib-compressed in their own key
+JOB_RESULT_INLINE_MAX_BYTES = int(os.environ.get('JOB_RESULT_INLINE_MAX_BYTES', '8192'))
+# every status change is published on bmo:job:<id>:events; waiters still re-read the hash
+# this often in case a message was lost while their pub/sub connection was reconnecting
+JOB_WAIT_RECHECK_SEC = float(os.environ.get('JOB_WAIT_RECHECK_SEC', '5'))
+TERMINAL_STATES = ('success', 'failed')
+# identical submissions of these (side-effect free) job types attach to the job already
+# queued/running, or to one that succeeded within the last JOB_DEDUPE_RECENT_SEC
+JOB_DEDUPE_TYPES = {
+    x.strip()
+    for x in os.environ.get('JOB_DEDUPE_TYPES', 'collect,download_attachment,download_attachments').split(',')
+    if x.strip()
+}
+JOB_DEDUPE_RECENT_SEC = int(os.environ.get('JOB_DEDUPE_RECENT_SEC', '30'))
+# upper bound for an unfinished job to hold its dedupe slot (covers lost workers)
+JOB_DEDUPE_INFLIGHT_SEC = int(os.environ.get('JOB_DEDUPE_INFLIGHT_SEC', '900'))
+DEDUPE_KEY_PREFIX = 'bmo:job:dedupe:'
+
+# interactive keeps the original list name so jobs queued before lanes existed still run
+LANES = ('interactive', 'sync', 'bulk')
+DEFAULT_LANE = 'interactive'
+JOB_LANE_WEIGHTS = os.environ.get('JOB_LANE_WEIGHTS', 'interactive:6,sync:3,bulk:1')
+
+# Pop the first queued job whose type is not saturated on the calling worker, lease it in
+# the processing zset and mark it running -- all in one round trip, so a crash can only
+# ever leave a job either queued or leased (and a lease always expires). Lanes are tried
+# in the order given, which the worker picks by weighted round-robin.
+# Every claimed job uses up exactly one signal token: the claim pops it, unless the caller
+# already did by waking up on it (signal_taken=1). A woken caller that can only see jobs of
+# its blocked types hands its token back so another worker wakes for them.
+# KEYS: processing, signal, lane queues...
+# ARGV: now_ms, lease_ms, owner, scan_limit, job_prefix, signal_taken, blocked types...
+CLAIM_LUA = """
+local blocked = {}
+for i = 7, #ARGV do blocked[ARGV[i]] = true end
+for k = 3, #KEYS do
+  local ids = redis.call('LRANGE', KEYS[k], 0, tonumber(ARGV[4]) - 1)
+  for _, id in ipairs(ids) do
+    local key = ARGV[5] .. id
+    local job_type = redis.call('HGET', key, 'type')
+    if not job_type then
+      redis.call('LREM', KEYS[k], 1, id)
+    elseif not blocked[job_type] then
+      redis.call('LREM', KEYS[k], 1, id)
+      if ARGV[6] ~= '1' then redis.call('LPOP', KEYS[2]) end
+      local now_ms = tonumber(ARGV[1])
+      redis.call('ZADD', KEYS[1], now_ms + tonumber(ARGV[2]), id)
+      redis.call('HSET', key, 'status', 'running', 'started_at', tostring(math.floor(now_ms / 1000)),
+        'error', '', 'lease_owner', ARGV[3])
+      redis.call('HINCRBY', key, 'attempts', 1)
+      redis.call('PUBLISH', key .. ':events', 'running')
+      local out = {id}
+      for _, v in ipairs(redis.call('HGETALL', key)) do out[#out + 1] = v end
+      return out
+    end
+  end
+end
+if ARGV[6] == '1' and #ARGV >= 7 then redis.call('RPUSH', KEYS[2], '1') end
+return false
+"""
+
+# KEYS: processing  ARGV: deadline_ms, job_prefix, then (job_id, owner) pairs
+RENEW_LUA = """
+local renewed = 0
+for i = 3, #ARGV, 2 do
+  if redis.call('HGET', ARGV[2] .. ARGV[i], 'lease_owner') == ARGV[i + 1] then
+    redis.call('ZADD', KEYS[1], 'XX', tonumber(ARGV[1]), ARGV[i])
+    renewed = renewed + 1
+  end
+end
+return renewed
+"""
+
+# Create a job unless an identical one is still pending/running or finished successfully
+# moments ago, in which case that job's id is returned instead. A still-queued job that a
+# higher-priority submission attaches to moves to that submission's lane, so a user request
+# never waits behind bulk traffic because a prefetch asked first.
+# KEYS: job hash, lane queue, signal, dedupe key  ARGV: job_id, dedupe_ttl, force, signal_max,
+# job_prefix, queue_key, lane, lanes by priority (space separated), field/value pairs...
+# Returns {job_id, 1 if attached to an existing job else 0}. New jobs are announced on KEYS[3]
+# as a pub/sub channel too (ARRIVALS_CHANNEL).
+ENQUEUE_LUA = """
+if ARGV[2] ~= '0' and ARGV[3] ~= '1' then
+  local existing = redis.call('GET', KEYS[4])
+  if existing then
+    local key = ARGV[5] .. existing
+    local status = redis.call('HGET', key, 'status')
+    if status and status ~= 'failed' then
+      if status == 'queued' then
+        local rank, n = {}, 0
+        for lane in string.gmatch(ARGV[8], '%S+') do
+          n = n + 1
+          rank[lane] = n
+        end
+        local current = redis.call('HGET', key, 'priority') or ''
+        if current == '' then current = 'interactive' end
+        if (rank[ARGV[7]] or n) < (rank[current] or n) then
+          local from = ARGV[6]
+          if current ~= 'interactive' then from = ARGV[6] .. ':' .. current end
+          if redis.call('LREM', from, 1, existing) > 0 then
+            redis.call('RPUSH', KEYS[2], existing)
+            redis.call('HSET', key, 'priority', ARGV[7])
+          end
+        end
+      end
+      return {existing, 1}
+    end
+  end
+end
+local job_type = ''
+for i = 9, #ARGV, 2 do
+  redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+  if ARGV[i] == 'type' then job_type = ARGV[i + 1] end
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('RPUSH', KEYS[3], '1')
+redis.call('LTRIM', KEYS[3], -tonumber(ARGV[4]), -1)
+redis.call('PUBLISH', KEYS[3], job_type)
+if ARGV[2] ~= '0' then
+  redis.call('SET', KEYS[4], ARGV[1], 'EX', tonumber(ARGV[2]))
+end
+return {ARGV[1], 0}
+"""
+
+# Commit a job's outcome only if the caller still owns its lease (fencing against a
+# job that was reaped and re-claimed elsewhere while this worker was stalled). A
+# successful job keeps its dedupe slot briefly; a failed one releases it at once.
+# KEYS: job hash, processing  ARGV: job_id, owner, ttl_sec, dedupe_recent_sec, field/value pairs...
+FINISH_LUA = """
+if redis.call('HGET', KEYS[1], 'lease_owner') ~= ARGV[2] then
+  return 0
+end
+for i = 5, #ARGV, 2 do
+  redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('HSET', KEYS[1], 'lease_owner', '')
+redis.call('ZREM', KEYS[2], ARGV[1])
+if tonumber(ARGV[3]) > 0 then
+  redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+end
+local status = redis.call('HGET', KEYS[1], 'status') or ''
+local dedupe = redis.call('HGET', KEYS[1], 'dedupe_key')
+if dedupe and dedupe ~= '' and redis.call('GET', dedupe) == ARGV[1] then
+  if status == 'success' and tonumber(ARGV[4]) > 0 then
+    redis.call('EXPIRE', dedupe, tonumber(ARGV[4]))
+  else
+    redis.call('DEL', dedupe)
+  end
+end
+redis.call('PUBLISH', KEYS[1] .. ':events', status)
+return 1
+"""
+
+# Re-queue (or fail, once attempts are exhausted) every job whose lease has expired.
+# KEYS: processing, signal  ARGV: now_ms, max_attempts, job_prefix, batch, queue_key, ttl_sec
+REAP_LUA = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[4]))
+local requeued, failed = 0, 0
+for _, id in ipairs(expired) do
+  redis.call('ZREM', KEYS[1], id)
+  local key = ARGV[3] .. id
+  if redis.call('EXISTS', key) == 1 then
+    local attempts = tonumber(redis.call('HGET', key, 'attempts') or '0') or 0
+    if attempts >= tonumber(ARGV[2]) then
+      redis.call('HSET', key, 'status', 'failed', 'lease_owner', '',
+        'finished_at', tostring(math.floor(tonumber(ARGV[1]) / 1000)),
+        'error', 'worker lease expired after ' .. attempts .. ' attempts')
+      if tonumber(ARGV[6]) > 0 then
+        redis.call('EXPIRE', key, tonumber(ARGV[6]))
+      end
+      local dedupe = redis.call('HGET', key, 'dedupe_key')
+      if dedupe and dedupe ~= '' and redis.call('GET', dedupe) == id then
+        redis.call('DEL', dedupe)
+      end
+      redis.call('PUBLISH', key .. ':events', 'failed')
+      failed = failed + 1
+    else
+      redis.call('HSET', key, 'status', 'queued', 'lease_owner', '', 'started_at', '')
+      local lane = redis.call('HGET', key, 'priority')
+      if lane and lane ~= '' and lane ~= 'interactive' then
+        redis.call('LPUSH', ARGV[5] .. ':' .. lane, id)
+      else
+        redis.call('LPUSH', ARGV[5], id)
+      end
+      redis.call('RPUSH', KEYS[2], '1')
+      redis.call('PUBLISH', KEYS[2], redis.call('HGET', key, 'type') or '')
+      redis.call('PUBLISH', key .. ':events', 'queued')
+      requeued = requeued + 1
+    end
+  end
+end
+return {requeued, failed}
+"""
+
+
+def job_key(job_id: str) -> str:
+    return f'{JOB_KEY_PREFIX}{job_id}'
+
+
+def events_channel(job_id: str) -> str:
+    return f'{job_key(job_id)}:events'
+
+
+def watch_job(
+    client: redis.Redis, job_id: str, timeout_sec: float, tick_sec: Optional[float] = None
+) -> Iterator[Optional[Dict[str, str]]]:
+    """Yield the job hash on every status change until it is terminal or the timeout passes.
+
+    Yields None whenever `tick_sec` elapses without a change so callers can send
+    keep-alives. Subscribes before the first read so a transition published in between
+    is not missed; a job that no longer exists ends the watch.
+    """
+    deadline = time.time() + max(0.0, timeout_sec)
+    tick = max(0.1, JOB_WAIT_RECHECK_SEC if tick_sec is None else tick_sec)
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(events_channel(job_id))
+        last_status = None
+        while True:
+            data = client.hgetall(job_key(job_id))
+            if not data:
+                return
+            status = str(data.get('status') or '').strip().lower()
+            if status != last_status:
+                last_status = status
+                yield data
+                if status in TERMINAL_STATES:
+                    return
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            # any event (or the periodic recheck) just triggers a fresh read of the hash
+            if pubsub.get_message(timeout=min(remaining, tick)) is None:
+                yield None
+    finally:
+        try:
+            pubsub.close()
+        except Exception:
+            pass
+
+
+def wait_for_terminal(client: redis.Redis, job_id: str, timeout_sec: float) -> Optional[Dict[str, str]]:
+    """Block until the job is success/failed and return its hash, or None on timeout."""
+    for data in watch_job(client, job_id, timeout_sec):
+        if data and str(data.get('status') or '').strip().lower() in TERMINAL_STATES:
+            return data
+    return None
+
+
+async def watch_job_async(
+    client: redis.asyncio.Redis, job_id: str, timeout_sec: float, tick_sec: Optional[float] = None
+) -> AsyncIterator[Optional[Dict[str, str]]]:
+    """asyncio counterpart of watch_job for the API service."""
+    deadline = time.time() + max(0.0, timeout_sec)
+    tick = max(0.1, JOB_WAIT_RECHECK_SEC if tick_sec is None else tick_sec)
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        await pubsub.subscribe(events_channel(job_id))
+        last_status = None
+        while True:
+            data = await client.hgetall(job_key(job_id))
+            if not data:
+                return
+            status = str(data.get('status') or '').strip().lower()
+            if status != last_status:
+                last_status = status
+                yield data
+                if status in TERMINAL_STATES:
+                    return
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            if await pubsub.get_message(timeout=min(remaining, tick)) is None:
+                yield None
+    finally:
+        try:
+            await pubsub.aclose()
+        except Exception:
+            pass
+
+
+async def wait_for_terminal_async(
+    client: redis.asyncio.Redis, job_id: str, timeout_sec: float
+) -> Optional[Dict[str, str]]:
+    async for data in watch_job_async(client, job_id, timeout_sec):
+        if data and str(data.get('status') or '').strip().lower() in TERMINAL_STATES:
+            return data
+    return None
+
+
+def encode_result(client: redis.Redis, job_id: str, result: Any) -> Dict[str, str]:
+    """Return the job-hash fields for a result, offloading large ones to a compressed key.
+
+    The blob key is unique per attempt, so a worker that lost its lease can never
+    overwrite the result committed by the job's current owner.
+    """
+    raw = serde.dumps_bytes(result)
+    if len(raw) <= max(0, JOB_RESULT_INLINE_MAX_BYTES):
+        return {'result': raw.decode('utf-8'), 'result_ref': '', 'result_bytes': str(len(raw))}
+    ref = f'{job_key(job_id)}:result:{uuid.uuid4().hex[:12]}'
+    client.set(ref, zlib.compress(raw, 6), ex=JOB_TTL_SEC if JOB_TTL_SEC > 0 else None)
+    return {'result': '', 'result_ref': ref, 'result_encoding': 'zlib+json', 'result_bytes': str(len(raw))}
+
+
+def decode_result(data: Dict[str, str], blob: Optional[bytes] = None) -> Any:
+    """Decode a job's result from its hash fields, or from the offloaded blob when it has one."""
+    if str(data.get('result_ref') or ''):
+        if blob is None:
+            return None
+        return serde.loads(zlib.decompress(blob))
+    text = str(data.get('result') or '').strip()
+    if not text:
+        return None
+    try:
+        return serde.loads(text)
+    except Exception:
+        return text
+
+
+def load_result(binary_client: redis.Redis, data: Dict[str, str]) -> Any:
+    ref = str(data.get('result_ref') or '')
+    return decode_result(data, binary_client.get(ref) if ref else None)
+
+
+async def load_result_async(binary_client: redis.asyncio.Redis, data: Dict[str, str]) -> Any:
+    ref = str(data.get('result_ref') or '')
+    return decode_result(data, await binary_client.get(ref) if ref else None)
+
+
+def dedupe_key(job_type: str, payload: Dict[str, Any], scope: str = '') -> Optional[str]:
+    """Canonical key for (type, payload), or None when the type must not be coalesced.
+
+    Jobs only coalesce within one `scope`; the API passes the collect cache generation
+    so a collect queued after a writeback never attaches to one that ran before it.
+    """
+    if job_type not in JOB_DEDUPE_TYPES:
+        return None
+    parts = [job_type, payload or {}] + ([scope] if scope else [])
+    canonical = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return DEDUPE_KEY_PREFIX + hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def enqueue_call(data: Dict[str, str], dedupe: Optional[str], force: bool) -> Tuple[List[str], List[str]]:
+    """KEYS/ARGV for ENQUEUE_LUA creating the job described by `data`."""
+    job_id = data['id']
+    lane = data.get('priority') or DEFAULT_LANE
+    keys = [job_key(job_id), lane_key(lane), SIGNAL_KEY, dedupe or job_key(job_id)]
+    args = [
+        job_id,
+        str(max(1, JOB_DEDUPE_INFLIGHT_SEC)) if dedupe else '0',
+        '1' if force else '0',
+        str(SIGNAL_MAX),
+        JOB_KEY_PREFIX,
+        QUEUE_KEY,
+        lane,
+        ' '.join(LANES),
+    ]
+    for name, value in data.items():
+        args.extend([name, value])
+    return keys, args
+
+
+def lane_key(lane: str) -> str:
+    return QUEUE_KEY if lane == DEFAULT_LANE else f'{QUEUE_KEY}:{lane}'
+
+
+def normalize_lane(value: Optional[str]) -> Optional[str]:
+    """Map a requested priority onto a lane; None means the value is not a known lane."""
+    lane = str(value or '').strip().lower() or DEFAULT_LANE
+    return lane if lane in LANES else None
+
+
+def push_job(pipe: Any, job_id: str, lane: str) -> None:
+    """Queue commands that append a job to its lane and wake one idle worker."""
+    push_jobs(pipe, [job_id], lane)
+
+
+def push_jobs(pipe: Any, job_ids: List[str], lane: str) -> None:
+    """Append many jobs to one lane with a single RPUSH, plus one wake-up token each."""
+    if not job_ids:
+        return
+    pipe.rpush(lane_key(lane), *job_ids)
+    pipe.rpush(SIGNAL_KEY, *(['1'] * len(job_ids)))
+    pipe.ltrim(SIGNAL_KEY, -SIGNAL_MAX, -1)
+    pipe.publish(ARRIVALS_CHANNEL, '')
+
+
+def parse_lane_weights(raw: str) -> Dict[str, int]:
+    weights = {lane: 1 for lane in LANES}
+    for part in str(raw or '').split(','):
+        name, _, value = part.partition(':')
+        name = name.strip().lower()
+        if name in weights and value.strip().isdigit():
+            # a zero weight would starve the lane forever; every lane gets at least one turn
+            weights[name] = max(1, int(value.strip()))
+    return weights
+
+
+class LaneScheduler:
+    """Smooth weighted round-robin over lanes, e.g. 6:3:1 => I I S I S I B I S I ..."""
+
+    def __init__(self, weights: Dict[str, int]):
+        self.weights = weights
+        self._current = {lane: 0 for lane in weights}
+        self._lock = threading.Lock()
+
+    def order(self) -> List[str]:
+        with self._lock:
+            total = sum(self.weights.values())
+            for lane, weight in self.weights.items():
+                self._current[lane] += weight
+            first = max(self._current, key=lambda lane: self._current[lane])
+            self._current[first] -= total
+        # an empty preferred lane falls through to the others, so no worker idles while work waits
+        rest = sorted((lane for lane in self.weights if lane != first), key=lambda lane: -self.weights[lane])
+        return [first, *rest]
+
+
+def _pairs(flat: List[str]) -> Dict[str, str]:
+    return {flat[i]: flat[i + 1] for i in range(0, len(flat) - 1, 2)}
+
+
+class JobQueue:
+    """Reliable claim/ack on top of the Redis job list used by api.py and worker.py."""
+
+    def __init__(self, client: redis.Redis, owner: str):
+        self.r = client
+        self.owner = owner
+        self.lanes = LaneScheduler(parse_lane_weights(JOB_LANE_WEIGHTS))
+        self._claim = client.register_script(CLAIM_LUA)
+        self._renew = client.register_script(RENEW_LUA)
+        self._finish = client.register_script(FINISH_LUA)
+        self._reap = client.register_script(REAP_LUA)
+
+    @staticmethod
+    def _lease_ms() -> int:
+        return max(5, JOB_LEASE_SEC) * 1000
+
+    def claim(
+        self, blocked_types: Iterable[str] = (), signal_taken: bool = False
+    ) -> Optional[Tuple[str, str, Dict[str, str]]]:
+        """Return (job_id, lease_token, job hash) for the next runnable job, or None.
+
+        Pass signal_taken=True right after wait_for_jobs() returned True: that wake-up
+        already consumed the job's signal token.
+        """
+        now_ms = int(time.time() * 1000)
+        token = f'{self.owner}:{now_ms}'
+        out = self._claim(
+            keys=[PROCESSING_KEY, SIGNAL_KEY, *(lane_key(lane) for lane in self.lanes.order())],
+            args=[
+                now_ms,
+                self._lease_ms(),
+                token,
+                max(1, CLAIM_SCAN_LIMIT),
+                JOB_KEY_PREFIX,
+                '1' if signal_taken else '0',
+                *blocked_types,
+            ],
+        )
+        if not out:
+            return None
+        return out[0], token, _pairs(out[1:])
+
+    def pending(self) -> int:
+        """Jobs waiting across all lanes."""
+        pipe = self.r.pipeline(transaction=False)
+        for lane in LANES:
+            pipe.llen(lane_key(lane))
+        return sum(int(n or 0) for n in pipe.execute())
+
+    def wait_for_jobs(self, timeout: int) -> bool:
+        return self.r.blpop(SIGNAL_KEY, timeout=timeout) is not None
+
+    def renew(self, held: Dict[str, str]) -> int:
+        if not held:
+            return 0
+        args: List[str] = [str(int(time.time() * 1000) + self._lease_ms()), JOB_KEY_PREFIX]
+        for job_id, token in held.items():
+            args.extend([job_id, token])
+        return int(self._renew(keys=[PROCESSING_KEY], args=args) or 0)
+
+    def finish(self, job_id: str, token: str, fields: Dict[str, str]) -> bool:
+        args: List[str] = [job_id, token, str(max(0, JOB_TTL_SEC)), str(max(0, JOB_DEDUPE_RECENT_SEC))]
+        for name, value in fields.items():
+            args.extend([name, value])
+        return bool(self._finish(keys=[job_key(job_id), PROCESSING_KEY], args=args))
+
+    def reap(self, batch: int = 100) -> Tuple[int, int]:
+        out = self._reap(
+            keys=[PROCESSING_KEY, SIGNAL_KEY],
+            args=[
+                int(time.time() * 1000),
+                max(1, JOB_MAX_ATTEMPTS),
+                JOB_KEY_PREFIX,
+                batch,
+                QUEUE_KEY,
+                max(0, JOB_TTL_SEC),
+            ],
+        )
+        return int(out[0]), int(out[1])
+
+
+def requeue(client: redis.Redis, job_id: str) -> None:
+    """Manually put a job back in the queue, revoking any lease a worker still holds."""
+    lane_raw, result_ref = client.hmget(job_key(job_id), ['priority', 'result_ref'])
+    pipe = client.pipeline(transaction=True)
+    _queue_requeue(pipe, job_id, normalize_lane(lane_raw) or DEFAULT_LANE, result_ref)
+    pipe.execute()
+
+
+async def requeue_async(client: redis.asyncio.Redis, job_id: str) -> None:
+    lane_raw, result_ref = await client.hmget(job_key(job_id), ['priority', 'result_ref'])
+    pipe = client.pipeline(transaction=True)
+    _queue_requeue(pipe, job_id, normalize_lane(lane_raw) or DEFAULT_LANE, result_ref)
+    await pipe.execute()
+
+
+def _queue_requeue(pipe: Any, job_id: str, lane: str, result_ref: Optional[str]) -> None:
+    # pipeline commands only buffer, so this serves both the sync and asyncio clients
+    pipe.zrem(PROCESSING_KEY, job_id)
+    if result_ref:
+        pipe.delete(result_ref)
+    pipe.hset(
+        job_key(job_id),
+        mapping={
+            'status': 'queued',
+            'error': '',
+            'finished_at': '',
+            'result': '',
+            'result_ref': '',
+            'lease_owner': '',
+            'attempts': '0',
+        },
+    )
+    # a queued job must not expire before a worker picks it up again
+    pipe.persist(job_key(job_id))
+    push_job(pipe, job_id, lane)
+    pipe.publish(events_channel(job_id), 'queued')
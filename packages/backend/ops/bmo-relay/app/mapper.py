@@ -0,0 +1,188 @@
+"""Declarative BMO list record -> craftsys mould record mapping.
+
+Each output field names a dotted source path into the raw BMO row and an extractor:
+
+    {"fields": {"partNo": "fd_col_zxcef7",
+                "supplier": {"path": "mk_model_20250521q2w2c_s_3zs0l.fd_col_zaz21j", "extract": "name"}}}
+
+A string is shorthand for {"path": ..., "extract": "value"}. Extractors:
+    value  the raw value
+    name   `fdName` of a person/org object, None for anything else
+    date   epoch millis -> ISO-8601 UTC, other values as trimmed strings
+
+The spec is compiled once into a single generated function, so mapping a page is one
+call per row with no per-field dispatch. BMO_RECORD_MAP_FILE points at a JSON file whose
+`fields` are merged over the built-in spec (null drops a field); the file is re-read
+whenever its mtime changes, so a renamed BMO form field is fixed without a deploy.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BMO_RECORD_MAP_FILE = str(os.environ.get('BMO_RECORD_MAP_FILE', '')).strip()
+
+_DETAIL = 'mk_model_20250521q2w2c_s_3zs0l'
+
+DEFAULT_SPEC: Dict[str, Any] = {
+    'fields': {
+        'bmoRecordId': 'fd_id',
+        'moldNumber': 'fd_mold_number',
+        'partNo': 'fd_col_zxcef7',
+        'partName': 'fd_col_hd3pvs',
+        'moldType': 'fd_col_ctjpe2',
+        'model': 'fd_col_00b6rj',
+        'budgetWanTaxIncl': 'fd_col_arsf4h',
+        'bidPriceTaxIncl': f'{_DETAIL}.fd_col_wifvm8',
+        'supplier': {'path': f'{_DETAIL}.fd_col_zaz21j', 'extract': 'name'},
+        'projectManager': {'path': 'fd_col_lj5ulc', 'extract': 'name'},
+        'moldEngineer': {'path': 'fd_col_egn9jl', 'extract': 'name'},
+        'designer': {'path': 'fd_col_2awc2z', 'extract': 'name'},
+        'projectNo': 'fd_col_projectno',
+        'processNo': 'fd_col_ds3lzr',
+        'assetNo': 'fd_col_b8gvrm',
+        'progressDays': 'fd_progress',
+        'bidTime': {'path': f'{_DETAIL}.fd_col_v01znm', 'extract': 'date'},
+        'projectEndTime': {'path': 'fd_col_fp487h', 'extract': 'date'},
+    }
+}
+
+
+def norm_date(value: Any) -> Optional[str]:
+    if value in (None, ''):
+        return None
+    # "YYYY-MM-DD ..." strings are the common case; don't pay for a failed int() on each
+    if not isinstance(value, str) or value.strip().isdigit():
+        try:
+            ts = int(value)
+            if ts > 1000000000000:
+                return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(ts / 1000.0))
+        except Exception:
+            pass
+    s = str(value).strip()
+    return s or None
+
+
+# every sync re-reads mostly the same rows, so the same timestamps come back page after page
+_norm_date_cached = lru_cache(maxsize=65536)(norm_date)
+
+
+def cached_date(value: Any) -> Optional[str]:
+    try:
+        return _norm_date_cached(value)
+    except TypeError:
+        return norm_date(value)
+
+
+# extractors are emitted as expressions around the looked-up value `{}`; `name` is inlined
+# because a person field is read on almost every row
+EXTRACTORS: Dict[str, str] = {
+    'value': '{}',
+    'name': '(_v.get("fdName") if isinstance(_v := {}, _dict) else None)',
+    'date': '_date({})',
+}
+
+
+def _field_specs(spec: Dict[str, Any]) -> List[Tuple[str, List[str], str]]:
+    fields = spec.get('fields')
+    if not isinstance(fields, dict) or not fields:
+        raise ValueError('record map needs a non-empty "fields" object')
+    out = []
+    for name, field in fields.items():
+        if isinstance(field, str):
+            field = {'path': field}
+        if not isinstance(field, dict):
+            raise ValueError(f'field {name!r}: expected a path string or an object')
+        path = [part for part in str(field.get('path') or '').split('.') if part]
+        extract = str(field.get('extract') or 'value')
+        if not path:
+            raise ValueError(f'field {name!r}: missing path')
+        if extract not in EXTRACTORS:
+            raise ValueError(f'field {name!r}: unknown extractor {extract!r}')
+        out.append((str(name), path, extract))
+    return out
+
+
+def compile_spec(spec: Dict[str, Any]) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Generate one straight-line function for the spec.
+
+    Nested objects shared by several fields (the detail sub-form) are looked up once
+    per row; every name and key is emitted with repr(), never spliced in raw.
+    """
+    fields = _field_specs(spec)
+    lines = ['def _map(item):']
+    parents: Dict[Tuple[str, ...], str] = {(): 'item'}
+    namespace: Dict[str, Any] = {'_dict': dict, '_EMPTY': {}, '_date': cached_date}
+    for _, path, extract in fields:
+        for depth in range(1, len(path)):
+            prefix = tuple(path[:depth])
+            if prefix in parents:
+                continue
+            var = f'_p{len(parents)}'
+            lines.append(f'    {var} = {parents[prefix[:-1]]}.get({prefix[-1]!r})')
+            lines.append(f'    if not isinstance({var}, _dict): {var} = _EMPTY')
+            parents[prefix] = var
+    lines.append('    return {')
+    for name, path, extract in fields:
+        expr = EXTRACTORS[extract].format(f'{parents[tuple(path[:-1])]}.get({path[-1]!r})')
+        lines.append(f'        {name!r}: {expr},')
+    lines.append('    }')
+    exec(compile('\n'.join(lines), '<bmo-record-map>', 'exec'), namespace)
+    return namespace['_map']
+
+
+def merge_spec(override: Dict[str, Any]) -> Dict[str, Any]:
+    fields = dict(DEFAULT_SPEC['fields'])
+    for name, field in (override.get('fields') or {}).items():
+        if field is None:
+            fields.pop(name, None)
+        else:
+            fields[name] = field
+    return {'fields': fields}
+
+
+_lock = threading.Lock()
+_compiled = compile_spec(DEFAULT_SPEC)
+_loaded_mtime: Optional[float] = None
+
+
+def _current() -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    global _compiled, _loaded_mtime
+    if not BMO_RECORD_MAP_FILE:
+        return _compiled
+    try:
+        mtime = os.stat(BMO_RECORD_MAP_FILE).st_mtime
+    except OSError:
+        return _compiled
+    if mtime == _loaded_mtime:
+        return _compiled
+    with _lock:
+        if mtime != _loaded_mtime:
+            try:
+                with open(BMO_RECORD_MAP_FILE, encoding='utf-8') as fp:
+                    _compiled = compile_spec(merge_spec(json.load(fp)))
+                print(f'[mapper] loaded record map from {BMO_RECORD_MAP_FILE}', flush=True)
+            except Exception as e:
+                # a broken edit keeps the last good mapping instead of failing every collect
+                print(f'[mapper] ignoring {BMO_RECORD_MAP_FILE}: {e}', flush=True)
+            _loaded_mtime = mtime
+    return _compiled
+
+
+def map_one(item: Dict[str, Any]) -> Dict[str, Any]:
+    return _current()(item or {})
+
+
+def map_many(items: List[Any]) -> List[Dict[str, Any]]:
+    fn = _current()
+    return [fn(item or {}) for item in items]
+
+
+if __name__ == '__main__':
+    # `python mapper.py > record_map.json` gives a starting point for BMO_RECORD_MAP_FILE
+    json.dump(DEFAULT_SPEC, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write('\n')
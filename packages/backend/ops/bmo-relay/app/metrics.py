@@ -0,0 +1,149 @@
+"""In-process Prometheus counters and histograms, shared by the API and the worker.
+
+Each process records into its own registry. Workers publish snapshot() to Redis next to
+their HTTP stats; the API's /metrics sums its own registry with every live worker
+snapshot and renders the Prometheus text format, so one scrape covers both processes.
+A worker that stops publishing drops out of the sum once its key expires, which
+Prometheus reads as an ordinary counter reset.
+"""
+
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+METRICS_KEY_PREFIX = 'bmo:metrics:'
+
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+WAIT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+# name -> (type, help, histogram buckets)
+DEFINITIONS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    'bmo_relay_job_duration_seconds': ('histogram', 'Time a worker spent running a job, by job type.', DURATION_BUCKETS),
+    'bmo_relay_job_queue_wait_seconds': (
+        'histogram',
+        'Time from job creation (created_at) to a worker starting it, by job type.',
+        WAIT_BUCKETS,
+    ),
+    'bmo_relay_jobs_finished_total': ('counter', 'Jobs finished by workers, by job type and status.', ()),
+    'bmo_relay_upstream_request_duration_seconds': (
+        'histogram',
+        'Upstream HTTP latency until response headers, by endpoint.',
+        UPSTREAM_BUCKETS,
+    ),
+    'bmo_relay_upstream_responses_total': ('counter', 'Upstream HTTP responses, by endpoint and status code.', ()),
+    'bmo_relay_auth_refresh_total': ('counter', 'BMO session refreshes triggered by a 401/403, by status code.', ()),
+    'bmo_relay_download_bytes_total': ('counter', 'Attachment bytes downloaded from BMO.', ()),
+    'bmo_relay_upload_bytes_total': ('counter', 'Request body bytes uploaded, by target (bmo, craftsys).', ()),
+    'bmo_relay_collect_cache_events_total': ('counter', 'Collect page cache lookups and maintenance, by event.', ()),
+    'bmo_relay_sync_duration_seconds': ('histogram', 'Duration of sync runs, by mode and result.', DURATION_BUCKETS),
+}
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, _LabelKey], float] = {}
+# per series: [non-cumulative bucket counts..., +Inf count], sum, count
+_histograms: Dict[Tuple[str, _LabelKey], List[Any]] = {}
+
+
+def _label_key(labels: Dict[str, Any]) -> _LabelKey:
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels: Any) -> None:
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    buckets = DEFINITIONS[name][2]
+    index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+    key = (name, _label_key(labels))
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+        series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+
+def snapshot() -> Dict[str, Any]:
+    """JSON-friendly copy of this process's registry."""
+    with _lock:
+        return {
+            'counters': [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [
+                [name, dict(labels), list(series[0]), series[1], series[2]]
+                for (name, labels), series in _histograms.items()
+            ],
+        }
+
+
+def _merge(snapshots: Iterable[Dict[str, Any]]):
+    counters: Dict[Tuple[str, _LabelKey], float] = {}
+    histograms: Dict[Tuple[str, _LabelKey], List[Any]] = {}
+    for snap in snapshots:
+        for name, labels, value in snap.get('counters') or []:
+            key = (name, _label_key(labels))
+            counters[key] = counters.get(key, 0.0) + float(value)
+        for name, labels, buckets, total, count in snap.get('histograms') or []:
+            if name not in DEFINITIONS or len(buckets) != len(DEFINITIONS[name][2]) + 1:
+                continue  # bucket layout changed between releases; skip until the worker restarts
+            key = (name, _label_key(labels))
+            merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += float(total)
+            merged[2] += int(count)
+    return counters, histograms
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs: Sequence[Tuple[str, str]], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(pairs) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(snapshots: Iterable[Dict[str, Any]], gauges: Sequence[Tuple[str, str, Dict[str, Any], float]] = ()) -> str:
+    """Prometheus text exposition of the summed snapshots plus point-in-time gauges.
+
+    `gauges` are (name, help, labels, value); rows sharing a name share one header.
+    """
+    counters, histograms = _merge(snapshots)
+    lines: List[str] = []
+    for name, (kind, help_text, buckets) in DEFINITIONS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (series, labels), value in sorted(counters.items()):
+                if series == name:
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+            continue
+        for (series, labels), (counts, total, count) in sorted(histograms.items()):
+            if series != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + [None], counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound is None else _number(bound)
+                lines.append(f'{name}_bucket{_labels(labels, ("le", le))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {repr(float(total))}')
+            lines.append(f'{name}_count{_labels(labels)} {count}')
+    described = set()
+    for name, help_text, labels, value in gauges:
+        if name not in described:
+            described.add(name)
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name}{_labels(_label_key(labels))} {_number(value)}')
+    return '\n'.join(lines) + '\n'
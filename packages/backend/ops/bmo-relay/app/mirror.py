@@ -0,0 +1,359 @@
+"""SQLite mirror of the mapped BMO mould list, kept current by the sync.
+
+Every record the sync fetches is upserted here (changed or not) and a complete full
+sync prunes rows it did not see, so the table matches BMO as of the last run. Each row
+keeps the mapped record as JSON; the fields people filter and sort on are also copied
+into indexed columns. Calls are blocking; the API runs them in a worker thread.
+
+Mould number, part number and part name are also kept, folded into one string, in the
+narrow `moulds_search` table, with an FTS5 trigram index over it; triggers maintain both
+as rows are upserted. search() ranks candidates there and only reads the winning rows.
+Queries shorter than a trigram, and SQLite builds without FTS5/trigram (older than
+3.34), scan `moulds_search` instead.
+"""
+
+import base64
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import serde
+
+RELAY_DATA_DIR = os.environ.get('RELAY_DATA_DIR', '/data/relay')
+BMO_MIRROR_ENABLED = str(os.environ.get('BMO_MIRROR_ENABLED', '1')).strip().lower() not in {'0', 'false', 'no'}
+MOULDS_PAGE_MAX = int(os.environ.get('MOULDS_PAGE_MAX', '500'))
+
+# mapped field -> indexed column; only these can be sorted on or used in range filters
+# cheaply, any other mapped field is still filterable through json_extract
+INDEXED_FIELDS = {
+    'bmoRecordId': 'id',
+    'moldNumber': 'mold_number',
+    'projectNo': 'project_no',
+    'supplier': 'supplier',
+    'projectManager': 'project_manager',
+    'partNo': 'part_no',
+    'partName': 'part_name',
+    'model': 'model',
+    'bidTime': 'bid_time',
+    'projectEndTime': 'project_end_time',
+    'bidPriceTaxIncl': 'bid_price',
+}
+# columns are TEXT unless listed; declared affinity lets string query params compare
+# correctly against numeric columns
+COLUMN_TYPES = {'bid_price': 'NUMERIC'}
+FILTER_OPS = {'eq': '=', 'ne': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+SEARCH_COLUMNS = ('mold_number', 'part_no', 'part_name')
+SEARCH_LIMIT_MAX = int(os.environ.get('MOULDS_SEARCH_LIMIT_MAX', '50'))
+# the trigram tokenizer cannot match anything shorter than three characters
+TRIGRAM_MIN_CHARS = 3
+# searched columns, ASCII-lowercased and unit-separator delimited:
+# `\x1fmold\x1fpart no\x1fpart name\x1f`, so whole-value and prefix matches are instr() checks
+_SEP = chr(31)
+
+
+def _search_text_sql(row: str) -> str:
+    return 'char(31) || ' + ' || char(31) || '.join(f'lower({row}.{col})' for col in SEARCH_COLUMNS) + ' || char(31)'
+
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+_fts_ready = False
+
+
+class MirrorQueryError(ValueError):
+    """A /moulds query the mirror cannot answer (unknown sort field, bad cursor...)."""
+
+
+def db_path() -> Path:
+    return Path(RELAY_DATA_DIR) / 'moulds.sqlite3'
+
+
+def _columns() -> List[str]:
+    return list(INDEXED_FIELDS.values())
+
+
+def _ensure_schema(conn: sqlite3.Connection) -> None:
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        extra = ', '.join(
+            f"{col} {COLUMN_TYPES.get(col, 'TEXT')} NOT NULL DEFAULT ''" for col in _columns() if col != 'id'
+        )
+        conn.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS moulds (
+                id TEXT PRIMARY KEY,
+                {extra},
+                record TEXT NOT NULL,
+                sync_id TEXT NOT NULL DEFAULT '',
+                synced_at_ms INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS mirror_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """
+        )
+        existing = {row[1] for row in conn.execute('PRAGMA table_info(moulds)')}
+        for field, col in INDEXED_FIELDS.items():
+            if col not in existing:
+                # a column added in a later release is backfilled from the stored records
+                conn.execute(f"ALTER TABLE moulds ADD COLUMN {col} {COLUMN_TYPES.get(col, 'TEXT')} NOT NULL DEFAULT ''")
+                conn.execute(f"UPDATE moulds SET {col} = COALESCE(json_extract(record, '$.{field}'), '')")
+        for col in _columns():
+            if col != 'id':
+                # (col, id) matches the keyset ORDER BY, so paging never sorts
+                conn.execute(f'CREATE INDEX IF NOT EXISTS moulds_{col} ON moulds ({col}, id)')
+        _setup_search(conn)
+        _schema_ready = True
+
+
+def _setup_search(conn: sqlite3.Connection) -> None:
+    global _fts_ready
+    changed = ' OR '.join(f'old.{col} IS NOT new.{col}' for col in SEARCH_COLUMNS)
+    created = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'moulds_search'").fetchone() is None
+    conn.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS moulds_search (rid INTEGER PRIMARY KEY, search_text TEXT NOT NULL);
+        CREATE TRIGGER IF NOT EXISTS moulds_search_ai AFTER INSERT ON moulds BEGIN
+            INSERT INTO moulds_search (rid, search_text) VALUES (new.rowid, {_search_text_sql('new')});
+        END;
+        CREATE TRIGGER IF NOT EXISTS moulds_search_ad AFTER DELETE ON moulds BEGIN
+            DELETE FROM moulds_search WHERE rid = old.rowid;
+        END;
+        -- syncs re-upsert unchanged rows; only touch the index when a searched column changed
+        CREATE TRIGGER IF NOT EXISTS moulds_search_au AFTER UPDATE ON moulds WHEN {changed} BEGIN
+            UPDATE moulds_search SET search_text = {_search_text_sql('new')} WHERE rid = new.rowid;
+        END;
+        """
+    )
+    if created:
+        conn.execute(f'INSERT INTO moulds_search (rid, search_text) SELECT rowid, {_search_text_sql("moulds")} FROM moulds')
+    fts_created = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'moulds_search_fts'").fetchone() is None
+    try:
+        conn.executescript(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS moulds_search_fts USING fts5(
+                search_text, content='moulds_search', content_rowid='rid', tokenize='trigram'
+            );
+            CREATE TRIGGER IF NOT EXISTS moulds_search_fts_ai AFTER INSERT ON moulds_search BEGIN
+                INSERT INTO moulds_search_fts (rowid, search_text) VALUES (new.rid, new.search_text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS moulds_search_fts_ad AFTER DELETE ON moulds_search BEGIN
+                INSERT INTO moulds_search_fts (moulds_search_fts, rowid, search_text)
+                VALUES ('delete', old.rid, old.search_text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS moulds_search_fts_au AFTER UPDATE ON moulds_search BEGIN
+                INSERT INTO moulds_search_fts (moulds_search_fts, rowid, search_text)
+                VALUES ('delete', old.rid, old.search_text);
+                INSERT INTO moulds_search_fts (rowid, search_text) VALUES (new.rid, new.search_text);
+            END;
+            """
+        )
+        if fts_created:
+            conn.execute("INSERT INTO moulds_search_fts (moulds_search_fts) VALUES ('rebuild')")
+        _fts_ready = True
+    except sqlite3.OperationalError:
+        _fts_ready = False
+
+
+def _conn() -> sqlite3.Connection:
+    # one connection per thread; WAL lets /moulds read while a sync is writing
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        db_path().parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(db_path()), timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _ensure_schema(conn)
+        _local.conn = conn
+    return conn
+
+
+def _column_value(value: Any) -> Any:
+    # NULL would break (col, id) row-value comparisons; '' sorts before any text
+    if value is None or isinstance(value, (dict, list)):
+        return ''
+    return value
+
+
+def upsert(records: Iterable[Dict[str, Any]], sync_id: str) -> int:
+    now_ms = int(time.time() * 1000)
+    rows = []
+    for rec in records:
+        rec_id = str((rec or {}).get('bmoRecordId') or '').strip()
+        if not rec_id:
+            continue
+        values = [rec_id] + [_column_value(rec.get(field)) for field, col in INDEXED_FIELDS.items() if col != 'id']
+        rows.append(values + [serde.dumps(rec), sync_id, now_ms])
+    if not rows:
+        return 0
+    cols = _columns() + ['record', 'sync_id', 'synced_at_ms']
+    updates = ', '.join(f'{col} = excluded.{col}' for col in cols if col != 'id')
+    sql = (
+        f'INSERT INTO moulds ({", ".join(cols)}) VALUES ({", ".join("?" for _ in cols)}) '
+        f'ON CONFLICT(id) DO UPDATE SET {updates}'
+    )
+    conn = _conn()
+    with conn:
+        conn.execute('BEGIN')
+        conn.executemany(sql, rows)
+        _set_meta(conn, 'lastUpsertAtMs', str(now_ms))
+    return len(rows)
+
+
+def prune(sync_id: str) -> int:
+    """Drop rows a complete full sync did not touch; returns how many were removed."""
+    conn = _conn()
+    with conn:
+        conn.execute('BEGIN')
+        removed = conn.execute('DELETE FROM moulds WHERE sync_id != ?', (sync_id,)).rowcount
+        _set_meta(conn, 'lastFullSyncId', sync_id)
+        _set_meta(conn, 'lastFullAtMs', str(int(time.time() * 1000)))
+    return removed
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute(
+        'INSERT INTO mirror_meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value',
+        (key, value),
+    )
+
+
+def is_empty() -> bool:
+    return _conn().execute('SELECT 1 FROM moulds LIMIT 1').fetchone() is None
+
+
+def stats() -> Dict[str, Any]:
+    conn = _conn()
+    meta = dict(conn.execute('SELECT key, value FROM mirror_meta').fetchall())
+    return {
+        'rows': conn.execute('SELECT COUNT(*) FROM moulds').fetchone()[0],
+        'lastUpsertAtMs': int(meta.get('lastUpsertAtMs') or 0) or None,
+        'lastFullAtMs': int(meta.get('lastFullAtMs') or 0) or None,
+    }
+
+
+def _field_expr(field: str) -> str:
+    if field in INDEXED_FIELDS:
+        return INDEXED_FIELDS[field]
+    if not field.replace('_', '').isalnum():
+        raise MirrorQueryError(f'unknown field: {field}')
+    return f"json_extract(record, '$.{field}')"
+
+
+def _encode_cursor(sort_value: Any, rec_id: str) -> str:
+    return base64.urlsafe_b64encode(serde.dumps_bytes([sort_value, rec_id])).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        sort_value, rec_id = serde.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return sort_value, str(rec_id)
+    except Exception:
+        raise MirrorQueryError('invalid cursor')
+
+
+def query(
+    filters: Sequence[Tuple[str, str, Any]],
+    sort: str = 'bmoRecordId',
+    limit: int = 50,
+    after: Optional[str] = None,
+    fields: Optional[Sequence[str]] = None,
+    with_total: bool = False,
+) -> Dict[str, Any]:
+    """Filtered, keyset-paginated page of mirrored records.
+
+    `filters` are (field, op, value) with op in FILTER_OPS or `in` (value is a list);
+    `sort` is an indexed field, `-` prefixed for descending; `after` is the previous
+    page's nextCursor.
+    """
+    descending = sort.startswith('-')
+    sort_field = sort.lstrip('-+') or 'bmoRecordId'
+    if sort_field not in INDEXED_FIELDS:
+        raise MirrorQueryError(f'sort must be one of: {", ".join(INDEXED_FIELDS)}')
+    sort_col = INDEXED_FIELDS[sort_field]
+
+    where: List[str] = []
+    params: List[Any] = []
+    for field, op, value in filters:
+        expr = _field_expr(field)
+        if op == 'in':
+            where.append(f'{expr} IN ({", ".join("?" for _ in value)})')
+            params.extend(value)
+        elif op in FILTER_OPS:
+            where.append(f'{expr} {FILTER_OPS[op]} ?')
+            params.append(value)
+        else:
+            raise MirrorQueryError(f'unknown operator: {op}')
+    count_where, count_params = list(where), list(params)
+    if after:
+        sort_value, rec_id = _decode_cursor(after)
+        where.append(f'({sort_col}, id) {"<" if descending else ">"} (?, ?)')
+        params.extend([sort_value, rec_id])
+
+    limit = max(1, min(int(limit or 50), max(1, MOULDS_PAGE_MAX)))
+    direction = 'DESC' if descending else 'ASC'
+    sql = f'SELECT {sort_col}, id, record FROM moulds'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += f' ORDER BY {sort_col} {direction}, id {direction} LIMIT ?'
+    conn = _conn()
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+    items = []
+    for _, _, record in rows[:limit]:
+        rec = serde.loads(record)
+        items.append({name: rec.get(name) for name in fields} if fields else rec)
+    next_cursor = _encode_cursor(rows[limit - 1][0], rows[limit - 1][1]) if len(rows) > limit else None
+    out: Dict[str, Any] = {'list': items, 'count': len(items), 'nextCursor': next_cursor}
+    if with_total:
+        count_sql = 'SELECT COUNT(*) FROM moulds' + (' WHERE ' + ' AND '.join(count_where) if count_where else '')
+        out['total'] = conn.execute(count_sql, count_params).fetchone()[0]
+    return out
+
+
+def _fold(text: str) -> str:
+    # SQLite's lower() only folds ASCII; match it exactly
+    return ''.join(ch.lower() if ch.isascii() else ch for ch in text)
+
+
+def search(q: str, limit: int = 10, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """Typeahead over mould number, part number and part name.
+
+    Whole-value matches rank first, then prefix matches, then other substring
+    matches; ties sort by mould number. Matching ignores ASCII case.
+    """
+    text = _fold(' '.join(str(q or '').split()).replace(_SEP, ''))
+    if not text:
+        return {'list': [], 'count': 0, 'mode': None}
+    limit = max(1, min(int(limit or 10), max(1, SEARCH_LIMIT_MAX)))
+    # candidates are ranked on the narrow search table, the wide rows are only read for the winners
+    def rank(alias: str) -> str:
+        text_col = f'{alias}search_text'
+        return f'instr({text_col}, ?) > 0 DESC, instr({text_col}, ?) > 0 DESC, {text_col}, {alias}rid'
+
+    rank_params = [f'{_SEP}{text}{_SEP}', f'{_SEP}{text}']
+    if _fts_ready and len(text) >= TRIGRAM_MIN_CHARS:
+        mode = 'fts'
+        # one quoted phrase: trigram matches it as a substring of the folded text
+        source = 'moulds_search WHERE rid IN (SELECT rowid FROM moulds_search_fts WHERE moulds_search_fts MATCH ?)'
+        candidate_params: List[Any] = ['"' + text.replace('"', '""') + '"']
+    else:
+        mode = 'scan'
+        source = 'moulds_search WHERE instr(search_text, ?) > 0'
+        candidate_params = [text]
+    sql = (
+        f'SELECT m.record FROM (SELECT rid, search_text FROM {source} ORDER BY {rank("")} LIMIT ?) hit '
+        f'JOIN moulds m ON m.rowid = hit.rid ORDER BY {rank("hit.")}'
+    )
+    params = candidate_params + rank_params + [limit] + rank_params
+    items = []
+    for (record,) in _conn().execute(sql, params).fetchall():
+        rec = serde.loads(record)
+        items.append({name: rec.get(name) for name in fields} if fields else rec)
+    return {'list': items, 'count': len(items), 'mode': mode}
@@ -0,0 +1,108 @@
+"""JSON encoding for job payloads, results and status hashes.
+
+orjson is used when installed, then msgspec, then the stdlib; all three emit compact
+UTF-8 without ASCII escaping, so values written by one backend read back under any
+other. Objects a fast backend refuses (non-str keys, huge ints, arbitrary classes)
+fall back to the stdlib instead of failing the job.
+
+Not for hashing: dedupe keys, cache keys and record fingerprints keep using
+json.dumps(sort_keys=True) so they stay stable if the backend changes.
+"""
+
+import importlib.util
+import json
+import os
+from typing import Any, Callable, Dict, Tuple, Union
+
+# auto | orjson | msgspec | json
+RELAY_JSON_BACKEND = str(os.environ.get('RELAY_JSON_BACKEND', 'auto')).strip().lower() or 'auto'
+PREFERENCE = ('orjson', 'msgspec', 'json')
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _stdlib_loads(data: Union[str, bytes]) -> Any:
+    return json.loads(data)
+
+
+def _build(name: str) -> Tuple[Callable[[Any], bytes], Callable[[Union[str, bytes]], Any]]:
+    if name == 'orjson':
+        import orjson
+
+        option = orjson.OPT_NON_STR_KEYS
+
+        def _dumps(obj: Any) -> bytes:
+            try:
+                return orjson.dumps(obj, option=option)
+            except TypeError:
+                return _stdlib_dumps(obj)
+
+        return _dumps, orjson.loads
+    if name == 'msgspec':
+        import msgspec
+
+        encoder = msgspec.json.Encoder()
+        decoder = msgspec.json.Decoder()
+
+        def _dumps(obj: Any) -> bytes:
+            try:
+                return encoder.encode(obj)
+            except (TypeError, OverflowError):
+                return _stdlib_dumps(obj)
+
+        def _loads(data: Union[str, bytes]) -> Any:
+            try:
+                return decoder.decode(data)
+            except msgspec.DecodeError as e:
+                raise ValueError(str(e)) from e
+
+        return _dumps, _loads
+    return _stdlib_dumps, _stdlib_loads
+
+
+def available() -> Tuple[str, ...]:
+    return tuple(name for name in PREFERENCE if name == 'json' or importlib.util.find_spec(name) is not None)
+
+
+def _pick(requested: str) -> str:
+    names = available()
+    if requested in names:
+        return requested
+    if requested != 'auto':
+        print(f'[serde] {requested} is not installed; using {names[0]}', flush=True)
+    return names[0]
+
+
+BACKEND = ''
+_dumps_impl: Callable[[Any], bytes] = _stdlib_dumps
+_loads_impl: Callable[[Union[str, bytes]], Any] = _stdlib_loads
+
+
+def use(name: str) -> str:
+    """Switch backend (auto picks the fastest installed one); returns the backend in effect."""
+    global BACKEND, _dumps_impl, _loads_impl
+    BACKEND = _pick(name)
+    _dumps_impl, _loads_impl = _build(BACKEND)
+    return BACKEND
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    return _dumps_impl(obj)
+
+
+def dumps(obj: Any) -> str:
+    return _dumps_impl(obj).decode('utf-8')
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Parse JSON text or UTF-8 bytes; raises ValueError on malformed input."""
+    return _loads_impl(data)
+
+
+def info() -> Dict[str, Any]:
+    return {'backend': BACKEND, 'available': list(available())}
+
+
+use(RELAY_JSON_BACKEND)
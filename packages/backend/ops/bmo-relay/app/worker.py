@@ -3,21 +3,48 @@ import hashlib
 import mimetypes
 import json
 import os
+import socket
+import tempfile
+import threading
 import time
+import traceback
+import uuid
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from urllib.parse import urlencode
 
 import httpx
 import redis
+
+import bmo_http
+import collectcache
+import filestore
+import jobqueue
+import mapper
+import metrics
+import serde
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.serialization import load_der_public_key
 
 REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/0')
-QUEUE_KEY = os.environ.get('JOB_QUEUE_KEY', 'bmo_relay_jobs')
 POLL_TIMEOUT = int(os.environ.get('WORKER_POLL_TIMEOUT', '5'))
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', '4'))
+# per-type caps, overridable with WORKER_CONCURRENCY_<TYPE>; writebacks stay serial by default
+JOB_TYPE_DEFAULT_CONCURRENCY = {
+    'collect': WORKER_CONCURRENCY,
+    'download_attachment': max(1, WORKER_CONCURRENCY // 2),
+    # each batch fans out internally, so one at a time keeps total upstream load bounded
+    'download_attachments': 1,
+    'writeback': 1,
+    'upload_attachment': max(1, WORKER_CONCURRENCY // 2),
+}
 FILES_DIR = os.environ.get('FILES_DIR', '/data/files')
+DOWNLOAD_CHUNK_BYTES = int(os.environ.get('BMO_DOWNLOAD_CHUNK_BYTES', str(1024 * 1024)))
 
 BMO_BASE_URL = os.environ.get('BMO_BASE_URL', 'https://bmo.meiling.com:8023').rstrip('/')
 BMO_MOULD_DETAIL_FD_VIEW_ID = os.environ.get(
@@ -41,28 +68,51 @@ BMO_AUTH_AUTO_REFRESH = str(os.environ.get('BMO_AUTH_AUTO_REFRESH', '1')).strip(
 BMO_AUTH_REFRESH_COOLDOWN_SEC = int(os.environ.get('BMO_AUTH_REFRESH_COOLDOWN_SEC', '15'))
 BMO_HTTP_TIMEOUT_MS = int(os.environ.get('BMO_HTTP_TIMEOUT_MS', '60000'))
 AUTH_SESSION_KEY = os.environ.get('BMO_AUTH_REDIS_KEY', 'bmo:auth:session')
+AUTH_CHANNEL = os.environ.get('BMO_AUTH_REDIS_CHANNEL', 'bmo:auth:changed')
+HTTP_STATS_KEY_PREFIX = os.environ.get('BMO_HTTP_STATS_REDIS_PREFIX', 'bmo:http:stats:')
+HTTP_STATS_PUBLISH_SEC = int(os.environ.get('BMO_HTTP_STATS_PUBLISH_SEC', '15'))
+WORKER_ID = f'{socket.gethostname()}-{os.getpid()}'
+ATTACH_INDEX_KEY = os.environ.get('BMO_ATTACH_INDEX_REDIS_KEY', 'bmo:attach:index')
+ATTACH_LOCK_TTL_SEC = int(os.environ.get('BMO_ATTACH_LOCK_TTL_SEC', '300'))
+MECH_TOKEN_TTL_SEC = int(os.environ.get('BMO_MECH_TOKEN_TTL_SEC', '600'))
+BATCH_DOWNLOAD_CONCURRENCY = int(os.environ.get('BMO_BATCH_DOWNLOAD_CONCURRENCY', '4'))
+BATCH_DOWNLOAD_MAX_ITEMS = int(os.environ.get('BMO_BATCH_DOWNLOAD_MAX_ITEMS', '500'))
 
 r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+queue = jobqueue.JobQueue(r, WORKER_ID)
 Path(FILES_DIR).mkdir(parents=True, exist_ok=True)
 
 _AUTH = {
     'cookie': str(os.environ.get('BMO_COOKIE', '')).strip(),
     'token': str(os.environ.get('BMO_X_AUTH_TOKEN', '')).strip(),
     'last_refresh_at': 0.0,
+    'version': 0,
 }
+_AUTH_REFRESH_LOCK = threading.Lock()
+# guards _AUTH so a request never pairs a new cookie with an old token
+_AUTH_STATE_LOCK = threading.Lock()
 
 
 def _save_auth_to_redis(source: str) -> None:
+    with _AUTH_STATE_LOCK:
+        cookie = str(_AUTH.get('cookie') or '')
+        token = str(_AUTH.get('token') or '')
     try:
-        r.hset(
+        pipe = r.pipeline(transaction=True)
+        pipe.hset(
             AUTH_SESSION_KEY,
             mapping={
-                'cookie': str(_AUTH.get('cookie') or ''),
-                'token': str(_AUTH.get('token') or ''),
+                'cookie': cookie,
+                'token': token,
                 'updated_at': str(int(time.time())),
                 'source': str(source or 'worker')
             }
         )
+        pipe.hincrby(AUTH_SESSION_KEY, 'version', 1)
+        version = int(pipe.execute()[-1])
+        with _AUTH_STATE_LOCK:
+            _AUTH['version'] = max(int(_AUTH.get('version') or 0), version)
+        r.publish(AUTH_CHANNEL, str(version))
     except Exception:
         # keep worker running even if redis state write fails
         pass
@@ -76,19 +126,49 @@ def _sync_auth_from_redis() -> None:
     if not data:
         return
     # if session key exists, use it as source-of-truth (including empty string)
-    if 'cookie' in data:
-        _AUTH['cookie'] = str(data.get('cookie') or '')
-    if 'token' in data:
-        _AUTH['token'] = str(data.get('token') or '')
+    with _AUTH_STATE_LOCK:
+        if 'cookie' in data:
+            _AUTH['cookie'] = str(data.get('cookie') or '')
+        if 'token' in data:
+            _AUTH['token'] = str(data.get('token') or '')
+        version = str(data.get('version') or '').strip()
+        _AUTH['version'] = int(version) if version.isdigit() else 0
+
+
+def _auth_invalidation_loop() -> None:
+    """Reload the cached session whenever a newer version is published.
+
+    Every (re)subscribe triggers a full reload, so messages missed while the
+    connection was down cannot leave the worker on a stale session.
+    """
+    while True:
+        pubsub = r.pubsub()
+        try:
+            pubsub.subscribe(AUTH_CHANNEL)
+            for message in pubsub.listen():
+                kind = message.get('type')
+                if kind == 'subscribe':
+                    _sync_auth_from_redis()
+                    continue
+                if kind != 'message':
+                    continue
+                raw = str(message.get('data') or '').strip()
+                with _AUTH_STATE_LOCK:
+                    current = int(_AUTH.get('version') or 0)
+                if not raw.isdigit() or int(raw) > current:
+                    _sync_auth_from_redis()
+        except Exception:
+            time.sleep(1.0)
+        finally:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
 
 
 _save_auth_to_redis('boot')
 
 
-def job_key(job_id: str) -> str:
-    return f'bmo:job:{job_id}'
-
-
 def _norm_timeout_ms(timeout_ms: int) -> float:
     v = int(timeout_ms or BMO_HTTP_TIMEOUT_MS)
     if v <= 0:
@@ -122,7 +202,14 @@ def _encrypt_password(password: str, pubkey_base64: str) -> str:
     return base64.b64encode(encrypted).decode('ascii')
 
 
-def _refresh_auth_via_api() -> None:
+def _refresh_auth_via_api(status_code: int) -> None:
+    metrics.inc('bmo_relay_auth_refresh_total', code=str(status_code))
+    # concurrent jobs hitting 401 at once share a single login
+    with _AUTH_REFRESH_LOCK:
+        _refresh_auth_locked()
+
+
+def _refresh_auth_locked() -> None:
     now = time.time()
     if now - float(_AUTH.get('last_refresh_at') or 0) < BMO_AUTH_REFRESH_COOLDOWN_SEC:
         return
@@ -143,73 +230,82 @@ def _refresh_auth_via_api() -> None:
     }
     timeout = _norm_timeout_ms(15000)
 
-    with httpx.Client(timeout=timeout, verify=False) as c:
-        pub_resp = c.post(
-            f'{BMO_BASE_URL}{BMO_LOGIN_PAGE_ENDPOINT}',
-            headers=headers,
-            json={'fdClient': 1},
-        )
-        if pub_resp.status_code >= 400:
-            raise RuntimeError(f'BMO 自动续期失败：获取公钥 HTTP {pub_resp.status_code}')
-        pubkey = pub_resp.headers.get('x-pubkey', '')
-        if not pubkey:
-            raise RuntimeError('BMO 自动续期失败：未返回 x-pubkey')
-
-        encrypted_password = _encrypt_password(password, pubkey)
-        login_headers = {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Accept': 'application/json, text/plain, */*',
-            'X-Accept-Language': 'zh-CN',
-            'Accept-Language': 'zh-CN,zh;q=0.9',
-            'Origin': BMO_BASE_URL,
-            'Referer': f'{BMO_BASE_URL}/web/',
-        }
-        login_resp = c.post(
-            f'{BMO_BASE_URL}{BMO_LOGIN_ENDPOINT}',
-            headers=login_headers,
-            content=urlencode({'j_username': username, 'j_password': encrypted_password}),
-        )
-        login_text = login_resp.text
-        login_json: Dict[str, Any] = {}
-        try:
-            login_json = login_resp.json()
-        except Exception:
-            login_json = {}
-        if login_resp.status_code >= 400 or login_json.get('success') is False:
-            msg = login_json.get('msg') or login_json.get('message') or login_text[:180]
-            raise RuntimeError(f'BMO 自动续期失败：{msg}')
-
-        set_cookie_values = login_resp.headers.get_list('set-cookie')
-        cookie_header = _cookie_header_from_set_cookie(set_cookie_values)
-        token = (
-            login_resp.headers.get('x-auth-token')
-            or ((login_json.get('data') or {}).get('token') if isinstance(login_json.get('data'), dict) else '')
-            or login_json.get('token')
-            or ''
-        )
-        token = str(token or '').strip()
-        if token and 'X-AUTH-TOKEN=' not in cookie_header:
-            cookie_header = f'{cookie_header}; X-AUTH-TOKEN={token}' if cookie_header else f'X-AUTH-TOKEN={token}'
-        if not cookie_header and not token:
-            raise RuntimeError('BMO 自动续期失败：登录后未获得 Cookie/Token')
-
-    if cookie_header:
-        _AUTH['cookie'] = cookie_header
-    if token:
-        _AUTH['token'] = token
-    _AUTH['last_refresh_at'] = now
+    pub_resp = bmo_http.post(
+        f'{BMO_BASE_URL}{BMO_LOGIN_PAGE_ENDPOINT}',
+        timeout=timeout,
+        headers=headers,
+        json={'fdClient': 1},
+    )
+    if pub_resp.status_code >= 400:
+        raise RuntimeError(f'BMO 自动续期失败：获取公钥 HTTP {pub_resp.status_code}')
+    pubkey = pub_resp.headers.get('x-pubkey', '')
+    if not pubkey:
+        raise RuntimeError('BMO 自动续期失败：未返回 x-pubkey')
+
+    encrypted_password = _encrypt_password(password, pubkey)
+    login_headers = {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Accept': 'application/json, text/plain, */*',
+        'X-Accept-Language': 'zh-CN',
+        'Accept-Language': 'zh-CN,zh;q=0.9',
+        'Origin': BMO_BASE_URL,
+        'Referer': f'{BMO_BASE_URL}/web/',
+    }
+    # the pooled client keeps no cookie jar, so carry the login-page session over by hand
+    page_cookie = _cookie_header_from_set_cookie(pub_resp.headers.get_list('set-cookie'))
+    if page_cookie:
+        login_headers['Cookie'] = page_cookie
+    login_resp = bmo_http.post(
+        f'{BMO_BASE_URL}{BMO_LOGIN_ENDPOINT}',
+        timeout=timeout,
+        headers=login_headers,
+        content=urlencode({'j_username': username, 'j_password': encrypted_password}),
+    )
+    login_text = login_resp.text
+    login_json: Dict[str, Any] = {}
+    try:
+        login_json = login_resp.json()
+    except Exception:
+        login_json = {}
+    if login_resp.status_code >= 400 or login_json.get('success') is False:
+        msg = login_json.get('msg') or login_json.get('message') or login_text[:180]
+        raise RuntimeError(f'BMO 自动续期失败：{msg}')
+
+    set_cookie_values = login_resp.headers.get_list('set-cookie')
+    cookie_header = _cookie_header_from_set_cookie(set_cookie_values)
+    token = (
+        login_resp.headers.get('x-auth-token')
+        or ((login_json.get('data') or {}).get('token') if isinstance(login_json.get('data'), dict) else '')
+        or login_json.get('token')
+        or ''
+    )
+    token = str(token or '').strip()
+    if token and 'X-AUTH-TOKEN=' not in cookie_header:
+        cookie_header = f'{cookie_header}; X-AUTH-TOKEN={token}' if cookie_header else f'X-AUTH-TOKEN={token}'
+    if not cookie_header and not token:
+        raise RuntimeError('BMO 自动续期失败：登录后未获得 Cookie/Token')
+
+    with _AUTH_STATE_LOCK:
+        if cookie_header:
+            _AUTH['cookie'] = cookie_header
+        if token:
+            _AUTH['token'] = token
+        _AUTH['last_refresh_at'] = now
     _save_auth_to_redis('auto-refresh')
 
 
 def _auth_headers(include_json_content_type: bool = True) -> Dict[str, str]:
-    _sync_auth_from_redis()
+    # served from the in-process copy; _auth_invalidation_loop keeps it current
+    with _AUTH_STATE_LOCK:
+        cookie = str(_AUTH.get('cookie') or '')
+        token = str(_AUTH.get('token') or '')
     h: Dict[str, str] = {}
     if include_json_content_type:
         h['Content-Type'] = 'application/json;charset=UTF-8'
-    if _AUTH.get('cookie'):
-        h['Cookie'] = str(_AUTH.get('cookie'))
-    if _AUTH.get('token'):
-        h['X-AUTH-TOKEN'] = str(_AUTH.get('token'))
+    if cookie:
+        h['Cookie'] = cookie
+    if token:
+        h['X-AUTH-TOKEN'] = token
     return h
 
 
@@ -225,25 +321,26 @@ def _request_with_auto_refresh(
     url = f'{BMO_BASE_URL}{path}'
     timeout = _norm_timeout_ms(timeout_ms)
 
-    with httpx.Client(timeout=timeout, verify=False) as c:
-        resp = c.request(
+    resp = bmo_http.request(
+        method.upper(),
+        url,
+        timeout=timeout,
+        headers=_auth_headers(include_json_content_type=include_json_content_type),
+        json=json_payload,
+        content=body,
+    )
+
+    if resp.status_code in (401, 403) and BMO_AUTH_AUTO_REFRESH:
+        _refresh_auth_via_api(resp.status_code)
+        resp = bmo_http.request(
             method.upper(),
             url,
+            timeout=timeout,
             headers=_auth_headers(include_json_content_type=include_json_content_type),
             json=json_payload,
             content=body,
         )
-
-        if resp.status_code in (401, 403) and BMO_AUTH_AUTO_REFRESH:
-            _refresh_auth_via_api()
-            resp = c.request(
-                method.upper(),
-                url,
-                headers=_auth_headers(include_json_content_type=include_json_content_type),
-                json=json_payload,
-                content=body,
-            )
-        return resp
+    return resp
 
 
 def _bmo_post_json(path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -273,94 +370,104 @@ def _bmo_post(path: str, body: str = '{}') -> httpx.Response:
     )
 
 
-def _bmo_get_bytes(path: str) -> httpx.Response:
-    return _request_with_auto_refresh(
-        'GET',
-        path,
-        timeout_ms=60000,
-        include_json_content_type=False,
-    )
-
+def _write_stream_to_cas(resp: httpx.Response) -> Dict[str, Any]:
+    """Stream a response body into the content-addressed store, hashing on the fly.
 
-def _norm_date(value):
-    if value in (None, ''):
-        return None
+    Bytes land in a temp file under FILES_DIR and are renamed to cas/<sha256> only
+    once complete, so readers never see a partial file and memory stays at one
+    chunk regardless of attachment size.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(prefix='dl_', suffix='.part', dir=str(filestore.tmp_dir()))
     try:
-        ts = int(value)
-        if ts > 1000000000000:
-            return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(ts / 1000.0))
-    except Exception:
-        pass
-    s = str(value).strip()
-    return s or None
-
-
-def map_bmo_record(item: Dict[str, Any]) -> Dict[str, Any]:
-    detail = item.get('mk_model_20250521q2w2c_s_3zs0l') or {}
+        with os.fdopen(fd, 'wb') as fp:
+            for chunk in resp.iter_bytes(max(64 * 1024, DOWNLOAD_CHUNK_BYTES)):
+                fp.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+            fp.flush()
+            os.fsync(fp.fileno())
+        sha256 = digest.hexdigest()
+        metrics.inc('bmo_relay_download_bytes_total', size)
+        target = filestore.cas_path(sha256)
+        if target.is_file():
+            os.unlink(tmp_name)
+            filestore.touch(target)
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_name, target)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
     return {
-        'bmoRecordId': item.get('fd_id'),
-        'moldNumber': item.get('fd_mold_number'),
-        'partNo': item.get('fd_col_zxcef7'),
-        'partName': item.get('fd_col_hd3pvs'),
-        'moldType': item.get('fd_col_ctjpe2'),
-        'model': item.get('fd_col_00b6rj'),
-        'budgetWanTaxIncl': item.get('fd_col_arsf4h'),
-        'bidPriceTaxIncl': detail.get('fd_col_wifvm8'),
-        'supplier': (detail.get('fd_col_zaz21j') or {}).get('fdName')
-        if isinstance(detail.get('fd_col_zaz21j'), dict)
-        else None,
-        'projectManager': (item.get('fd_col_lj5ulc') or {}).get('fdName')
-        if isinstance(item.get('fd_col_lj5ulc'), dict)
-        else None,
-        'moldEngineer': (item.get('fd_col_egn9jl') or {}).get('fdName')
-        if isinstance(item.get('fd_col_egn9jl'), dict)
-        else None,
-        'designer': (item.get('fd_col_2awc2z') or {}).get('fdName')
-        if isinstance(item.get('fd_col_2awc2z'), dict)
-        else None,
-        'projectNo': item.get('fd_col_projectno'),
-        'processNo': item.get('fd_col_ds3lzr'),
-        'assetNo': item.get('fd_col_b8gvrm'),
-        'progressDays': item.get('fd_progress'),
-        'bidTime': _norm_date(detail.get('fd_col_v01znm')),
-        'projectEndTime': _norm_date(item.get('fd_col_fp487h')),
+        'size': size,
+        'sha256': sha256,
+        'contentType': resp.headers.get('content-type', 'application/octet-stream'),
     }
 
 
-def run_collect(payload: Dict[str, Any]) -> Dict[str, Any]:
-    page_size = int(payload.get('pageSize') or 50)
-    offset = int(payload.get('offset') or 0)
-
-    incoming_sorts = payload.get('sorts')
-    if not isinstance(incoming_sorts, dict):
-        incoming_sorts = {'fd_create_time': 'desc'}
+def _bmo_download_to_cas(path: str) -> Dict[str, Any]:
+    url = f'{BMO_BASE_URL}{path}'
+    timeout = _norm_timeout_ms(60000)
+    refreshed = False
+    while True:
+        with bmo_http.stream(
+            'GET',
+            url,
+            timeout=timeout,
+            headers=_auth_headers(include_json_content_type=False),
+        ) as resp:
+            needs_refresh = resp.status_code in (401, 403) and BMO_AUTH_AUTO_REFRESH and not refreshed
+            if not needs_refresh:
+                if resp.status_code >= 400:
+                    resp.read()
+                    error = MechTokenRejected if resp.status_code in (401, 403) else RuntimeError
+                    raise error(f'download HTTP {resp.status_code}: {resp.text[:220]}')
+                return _write_stream_to_cas(resp)
+        _refresh_auth_via_api(resp.status_code)
+        refreshed = True
 
-    incoming_conditions = payload.get('conditions')
-    if not isinstance(incoming_conditions, dict):
-        incoming_conditions = {}
 
-    incoming_params = payload.get('params')
-    if not isinstance(incoming_params, dict):
-        incoming_params = {}
+def run_collect(payload: Dict[str, Any]) -> Dict[str, Any]:
+    query = collectcache.normalize_query(payload)
+    page_size = query['pageSize']
+    offset = query['offset']
 
     req = {
         'fdListViewId': BMO_LIST_VIEW_ID,
         'fdMode': 1,
         'type': 'list',
         'navId': BMO_LIST_NAV_ID,
-        'sorts': incoming_sorts,
-        'conditions': incoming_conditions,
+        'sorts': query['sorts'],
+        'conditions': query['conditions'],
         'pageSize': page_size,
         'offset': offset,
-        'params': incoming_params,
+        'params': query['params'],
     }
 
+    # read before the fetch so a writeback racing this collect invalidates what it stores
+    cache_generation = collectcache.generation(r)
     data = _bmo_post_json('/data/sys-modeling/sysModelingMain/data', req)
     body = data.get('data') or {}
     content = body.get('content') or []
     total = body.get('totalSize')
-    mapped = [map_bmo_record(x or {}) for x in content]
-    return {
+    mapped = mapper.map_many(content)
+    # the sync's incremental watermark is a raw BMO field that the record map drops
+    watermark_field = str(payload.get('watermarkField') or '').strip()
+    watermark = None
+    if watermark_field:
+        values = [x.get(watermark_field) for x in content if isinstance(x, dict)]
+        values = [v for v in values if v not in (None, '')]
+        if values:
+            try:
+                watermark = max(values, key=float)
+            except (TypeError, ValueError):
+                watermark = max(str(v) for v in values)
+    result = {
         'count': len(mapped),
         'total': int(total or 0),
         'offset': offset,
@@ -368,16 +475,90 @@ def run_collect(payload: Dict[str, Any]) -> Dict[str, Any]:
         'traceId': data.get('traceId'),
         'fetchedAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
         'list': mapped,
+        'watermark': watermark,
     }
+    collectcache.store(r, payload, result, cache_generation)
+    return result
 
 
-def run_download_attachment(payload: Dict[str, Any]) -> Dict[str, Any]:
-    fd_id = str(payload.get('fdId') or '').strip()
-    attachment_id = str(payload.get('attachmentId') or '').strip()
-    file_name = str(payload.get('fileName') or f'{attachment_id}.bin').strip()
-    if not fd_id or not attachment_id:
-        raise RuntimeError('payload 缺少 fdId/attachmentId')
+_flight_guard = threading.Lock()
+_flight_locks: Dict[str, List[Any]] = {}
+
+
+@contextmanager
+def _attachment_flight(attachment_id: str) -> Iterator[None]:
+    """Serialize downloads of one attachment across threads and worker processes.
+
+    Whoever enters second waits for the first download to land and then finds it
+    in the index, so concurrent requests share a single upstream transfer.
+    """
+    with _flight_guard:
+        entry = _flight_locks.setdefault(attachment_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            lock_key = f'bmo:attach:lock:{attachment_id}'
+            token = uuid.uuid4().hex
+            deadline = time.time() + max(1, ATTACH_LOCK_TTL_SEC)
+            acquired = False
+            while time.time() < deadline:
+                if r.set(lock_key, token, nx=True, ex=max(1, ATTACH_LOCK_TTL_SEC)):
+                    acquired = True
+                    break
+                time.sleep(0.5)
+            try:
+                yield
+            finally:
+                if acquired and r.get(lock_key) == token:
+                    r.delete(lock_key)
+    finally:
+        with _flight_guard:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                _flight_locks.pop(attachment_id, None)
+
+
+def _attachment_index_get(attachment_id: str) -> Optional[Dict[str, Any]]:
+    return _attachment_index_hit(r.hget(ATTACH_INDEX_KEY, attachment_id))
+
+
+def _attachment_index_get_many(attachment_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Index hits for many attachments in one HMGET; misses are left out."""
+    if not attachment_ids:
+        return {}
+    hits = {}
+    for attachment_id, raw in zip(attachment_ids, r.hmget(ATTACH_INDEX_KEY, attachment_ids)):
+        hit = _attachment_index_hit(raw)
+        if hit:
+            hits[attachment_id] = hit
+    return hits
+
+
+def _attachment_index_hit(raw: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not raw:
+        return None
+    try:
+        meta = json.loads(raw)
+    except Exception:
+        return None
+    sha256 = str(meta.get('sha256') or '')
+    blob = filestore.cas_path(sha256) if sha256 else None
+    if blob is None or not blob.is_file():
+        # blob expired by cleanup-files.sh; fall through to a fresh download
+        return None
+    filestore.touch(blob)
+    return {**meta, 'cached': True}
+
+
+class MechTokenRejected(RuntimeError):
+    """checkDownload/download refused the mechAuthToken even after an auth refresh."""
+
+
+_mech_tokens_lock = threading.Lock()
+_MECH_TOKENS: Dict[str, Tuple[str, float]] = {}
 
+
+def _view_mech_token(fd_id: str) -> str:
     view_req = {
         'fdId': fd_id,
         'fdMode': 1,
@@ -392,28 +573,209 @@ def run_download_attachment(payload: Dict[str, Any]) -> Dict[str, Any]:
     )
     if not mech:
         raise RuntimeError('view 成功但缺少 mechAuthToken')
+    return str(mech)
+
+
+def _mech_token(fd_id: str) -> Tuple[str, bool]:
+    """Return (mechAuthToken, from_cache); one view call serves every attachment of a record."""
+    now = time.time()
+    with _mech_tokens_lock:
+        cached = _MECH_TOKENS.get(fd_id)
+        if cached and cached[1] > now:
+            return cached[0], True
+    mech = _view_mech_token(fd_id)
+    with _mech_tokens_lock:
+        _MECH_TOKENS[fd_id] = (mech, now + max(1, MECH_TOKEN_TTL_SEC))
+        if len(_MECH_TOKENS) > 4096:
+            for key in [k for k, (_, exp) in _MECH_TOKENS.items() if exp <= now]:
+                _MECH_TOKENS.pop(key, None)
+    return mech, False
+
 
+def _forget_mech_token(fd_id: str) -> None:
+    with _mech_tokens_lock:
+        _MECH_TOKENS.pop(fd_id, None)
+
+
+def _fetch_with_mech(attachment_id: str, mech: str) -> Dict[str, Any]:
     check = _bmo_post(f'/data/sys-attach/checkDownload/{attachment_id}?mechAuthToken={mech}', '{}')
     if check.status_code >= 400:
-        raise RuntimeError(f'checkDownload HTTP {check.status_code}: {check.text[:220]}')
+        error = MechTokenRejected if check.status_code in (401, 403) else RuntimeError
+        raise error(f'checkDownload HTTP {check.status_code}: {check.text[:220]}')
+
+    return _bmo_download_to_cas(f'/data/sys-attach/download/{attachment_id}?mechAuthToken={mech}')
+
+
+def _fetch_attachment(fd_id: str, attachment_id: str) -> Dict[str, Any]:
+    mech, from_cache = _mech_token(fd_id)
+    try:
+        return _fetch_with_mech(attachment_id, mech)
+    except MechTokenRejected:
+        _forget_mech_token(fd_id)
+        if not from_cache:
+            raise
+    # the cached token went stale upstream; take a fresh view once
+    mech, _ = _mech_token(fd_id)
+    return _fetch_with_mech(attachment_id, mech)
+
+
+def _load_attachment(fd_id: str, attachment_id: str, force: bool = False) -> Dict[str, Any]:
+    if not force:
+        hit = _attachment_index_get(attachment_id)
+        if hit:
+            return hit
+    with _attachment_flight(attachment_id):
+        if not force:
+            hit = _attachment_index_get(attachment_id)
+            if hit:
+                return hit
+        stored = _fetch_attachment(fd_id, attachment_id)
+        r.hset(ATTACH_INDEX_KEY, attachment_id, json.dumps(stored, ensure_ascii=False))
+        return {**stored, 'cached': False}
+
+
+def run_download_attachment(payload: Dict[str, Any]) -> Dict[str, Any]:
+    fd_id = str(payload.get('fdId') or '').strip()
+    attachment_id = str(payload.get('attachmentId') or '').strip()
+    file_name = str(payload.get('fileName') or f'{attachment_id}.bin').strip()
+    if not fd_id or not attachment_id:
+        raise RuntimeError('payload 缺少 fdId/attachmentId')
 
-    dl = _bmo_get_bytes(f'/data/sys-attach/download/{attachment_id}?mechAuthToken={mech}')
-    if dl.status_code >= 400:
-        raise RuntimeError(f'download HTTP {dl.status_code}: {dl.text[:220]}')
+    safe_name = filestore.safe_file_name(file_name, f'{attachment_id}.bin')
+    stored = _load_attachment(fd_id, attachment_id, force=bool(payload.get('force')))
+    return {
+        'fileId': filestore.cas_file_id(stored['sha256'], safe_name),
+        'fileName': safe_name,
+        'size': stored['size'],
+        'sha256': stored['sha256'],
+        'contentType': stored['contentType'],
+        'cached': bool(stored.get('cached')),
+    }
 
-    safe_name = ''.join(ch if ch not in '\\/:*?"<>|\r\n' else '_' for ch in file_name) or f'{attachment_id}.bin'
-    file_id = f"{int(time.time() * 1000)}_{attachment_id}_{safe_name}"
-    path = Path(FILES_DIR) / file_id
-    path.write_bytes(dl.content)
 
-    sha256 = hashlib.sha256(dl.content).hexdigest()
+def _zip_arcname(name: str, used: Dict[str, int]) -> str:
+    count = used.get(name, 0)
+    used[name] = count + 1
+    if not count:
+        return name
+    stem, dot, ext = name.rpartition('.')
+    return f'{stem} ({count + 1}).{ext}' if dot and stem else f'{name} ({count + 1})'
+
+
+def _write_zip_archive(files: List[Dict[str, Any]], zip_name: str) -> Dict[str, Any]:
+    """Pack downloaded blobs into one ZIP under FILES_DIR, streaming each member from disk."""
+    safe_name = filestore.safe_file_name(zip_name, 'attachments.zip')
+    if not safe_name.lower().endswith('.zip'):
+        safe_name = f'{safe_name}.zip'
+    file_id = f'{int(time.time() * 1000)}_{safe_name}'
+    fd, tmp_name = tempfile.mkstemp(prefix='zip_', suffix='.part', dir=str(filestore.tmp_dir()))
+    used: Dict[str, int] = {}
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            # members are mostly PDFs/drawings that barely compress; store them as-is
+            with zipfile.ZipFile(fp, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+                for entry in files:
+                    blob = filestore.cas_path(entry['sha256'])
+                    zf.write(str(blob), arcname=_zip_arcname(entry['fileName'], used))
+            fp.flush()
+            os.fsync(fp.fileno())
+        target = Path(FILES_DIR) / file_id
+        os.replace(tmp_name, target)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
     return {
         'fileId': file_id,
         'fileName': safe_name,
-        'size': path.stat().st_size,
-        'sha256': sha256,
-        'contentType': dl.headers.get('content-type', 'application/octet-stream'),
+        'size': target.stat().st_size,
+        'count': len(files),
+        'contentType': 'application/zip',
+    }
+
+
+def run_download_attachments(payload: Dict[str, Any]) -> Dict[str, Any]:
+    raw_items = payload.get('items')
+    if not isinstance(raw_items, list) or not raw_items:
+        raise RuntimeError('download_attachments 缺少 items')
+    if len(raw_items) > BATCH_DOWNLOAD_MAX_ITEMS:
+        raise RuntimeError(f'download_attachments items 超过上限 {BATCH_DOWNLOAD_MAX_ITEMS}')
+    force = bool(payload.get('force'))
+
+    items: List[Dict[str, str]] = []
+    for raw in raw_items:
+        raw = raw if isinstance(raw, dict) else {}
+        attachment_id = str(raw.get('attachmentId') or '').strip()
+        items.append({
+            'fdId': str(raw.get('fdId') or '').strip(),
+            'attachmentId': attachment_id,
+            'fileName': filestore.safe_file_name(
+                str(raw.get('fileName') or '').strip(), f'{attachment_id or "attachment"}.bin'
+            ),
+        })
+
+    try:
+        concurrency = int(payload.get('concurrency') or BATCH_DOWNLOAD_CONCURRENCY)
+    except Exception:
+        concurrency = BATCH_DOWNLOAD_CONCURRENCY
+    concurrency = max(1, min(concurrency, BATCH_DOWNLOAD_CONCURRENCY, len(items)))
+
+    def _resolve_view(fd_id: str) -> Tuple[str, str]:
+        try:
+            _mech_token(fd_id)
+            return fd_id, ''
+        except Exception as e:
+            return fd_id, str(e)[:300]
+
+    def _download(item: Dict[str, str]) -> Dict[str, Any]:
+        entry: Dict[str, Any] = dict(item)
+        if not item['fdId'] or not item['attachmentId']:
+            entry.update(ok=False, error='缺少 fdId/attachmentId')
+            return entry
+        stored = hits.get(item['attachmentId'])
+        if stored is None and view_errors.get(item['fdId']):
+            entry.update(ok=False, error=view_errors[item['fdId']])
+            return entry
+        try:
+            stored = stored or _load_attachment(item['fdId'], item['attachmentId'], force=force)
+        except Exception as e:
+            entry.update(ok=False, error=str(e)[:300])
+            return entry
+        entry.update(
+            ok=True,
+            fileId=filestore.cas_file_id(stored['sha256'], item['fileName']),
+            size=stored['size'],
+            sha256=stored['sha256'],
+            contentType=stored['contentType'],
+            cached=bool(stored.get('cached')),
+        )
+        return entry
+
+    # files already in the content store are served without touching BMO at all
+    hits = {} if force else _attachment_index_get_many(
+        sorted({item['attachmentId'] for item in items if item['attachmentId']})
+    )
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bmo-batch') as pool:
+        # one view per record that still has a file to fetch; its files then reuse the token
+        fd_ids = sorted({item['fdId'] for item in items if item['fdId'] and item['attachmentId'] not in hits})
+        view_errors = dict(pool.map(_resolve_view, fd_ids))
+        files = list(pool.map(_download, items))
+
+    succeeded = [f for f in files if f.get('ok')]
+    if not succeeded:
+        raise RuntimeError(f"附件全部下载失败: {files[0].get('error') or 'unknown'}")
+
+    out: Dict[str, Any] = {
+        'count': len(files),
+        'succeeded': len(succeeded),
+        'failed': len(files) - len(succeeded),
+        'files': files,
     }
+    if payload.get('zip'):
+        out['archive'] = _write_zip_archive(succeeded, str(payload.get('zipName') or 'attachments.zip'))
+    return out
 
 
 def run_writeback(payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -422,6 +784,8 @@ def run_writeback(payload: Dict[str, Any]) -> Dict[str, Any]:
     if not path:
         raise RuntimeError('writeback 缺少 path')
     data = _bmo_post_json(path, body)
+    # the record changed upstream; cached list pages may no longer match it
+    collectcache.invalidate(r)
     return {'path': path, 'response': data}
 
 
@@ -437,9 +801,10 @@ def run_upload_attachment(payload: Dict[str, Any]) -> Dict[str, Any]:
     form_fields = payload.get('fields') if isinstance(payload.get('fields'), dict) else {}
 
     if file_id:
-        src = Path(FILES_DIR) / Path(file_id).name
+        src, stored_name = filestore.resolve_file_id(file_id)
     elif local_file:
         src = Path(local_file).expanduser().resolve()
+        stored_name = src.name
     else:
         raise RuntimeError('upload_attachment 缺少 fileId/localFile')
 
@@ -447,34 +812,38 @@ def run_upload_attachment(payload: Dict[str, Any]) -> Dict[str, Any]:
         raise RuntimeError(f'upload file not found: {src}')
 
     if not file_name:
-        file_name = src.name
+        file_name = stored_name
 
     content_type = payload.get('contentType')
     if not content_type:
         content_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
 
+    size = src.stat().st_size
     with src.open('rb') as fp:
         files = {field_name: (file_name, fp, content_type)}
-        with httpx.Client(timeout=_norm_timeout_ms(90000), verify=False) as c:
-            resp = c.post(
+        metrics.inc('bmo_relay_upload_bytes_total', size, target='bmo')
+        resp = bmo_http.post(
+            f'{BMO_BASE_URL}{upload_path}',
+            timeout=_norm_timeout_ms(90000),
+            headers={k: v for k, v in _auth_headers(include_json_content_type=False).items() if k != 'Content-Type'},
+            data={k: str(v) for k, v in form_fields.items()},
+            files=files,
+        )
+        if resp.status_code in (401, 403) and BMO_AUTH_AUTO_REFRESH:
+            _refresh_auth_via_api(resp.status_code)
+            fp.seek(0)
+            metrics.inc('bmo_relay_upload_bytes_total', size, target='bmo')
+            resp = bmo_http.post(
                 f'{BMO_BASE_URL}{upload_path}',
-                headers={k: v for k, v in _auth_headers(include_json_content_type=False).items() if k != 'Content-Type'},
+                timeout=_norm_timeout_ms(90000),
+                headers={
+                    k: v
+                    for k, v in _auth_headers(include_json_content_type=False).items()
+                    if k != 'Content-Type'
+                },
                 data={k: str(v) for k, v in form_fields.items()},
                 files=files,
             )
-            if resp.status_code in (401, 403) and BMO_AUTH_AUTO_REFRESH:
-                _refresh_auth_via_api()
-                fp.seek(0)
-                resp = c.post(
-                    f'{BMO_BASE_URL}{upload_path}',
-                    headers={
-                        k: v
-                        for k, v in _auth_headers(include_json_content_type=False).items()
-                        if k != 'Content-Type'
-                    },
-                    data={k: str(v) for k, v in form_fields.items()},
-                    files=files,
-                )
 
     txt = resp.text
     out = None
@@ -490,7 +859,7 @@ def run_upload_attachment(payload: Dict[str, Any]) -> Dict[str, Any]:
         'path': upload_path,
         'statusCode': resp.status_code,
         'fileName': file_name,
-        'size': src.stat().st_size,
+        'size': size,
         'response': out,
     }
 
@@ -500,6 +869,8 @@ def run_job(job_type: str, payload: Dict[str, Any]) -> Dict[str, Any]:
         return run_collect(payload)
     if job_type == 'download_attachment':
         return run_download_attachment(payload)
+    if job_type == 'download_attachments':
+        return run_download_attachments(payload)
     if job_type == 'writeback':
         return run_writeback(payload)
     if job_type == 'upload_attachment':
@@ -507,36 +878,206 @@ def run_job(job_type: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     raise RuntimeError(f'unsupported job type: {job_type}')
 
 
-while True:
-    item = r.blpop(QUEUE_KEY, timeout=POLL_TIMEOUT)
-    if not item:
-        continue
-
-    _, job_id = item
-    data = r.hgetall(job_key(job_id))
-    if not data:
-        continue
-
+def process_job(job_id: str, token: str, data: Dict[str, str]) -> None:
+    """Run a claimed job; the claim already marked it running and leased it to us."""
     job_type = str(data.get('type') or '')
     try:
-        payload = json.loads(data.get('payload') or '{}')
+        payload = serde.loads(data.get('payload') or '{}')
     except Exception:
         payload = {}
 
-    now = int(time.time())
-    r.hset(job_key(job_id), mapping={'status': 'running', 'started_at': str(now), 'error': ''})
-
+    # both stamps are whole seconds (set by the API and the claim script)
+    created_at = int(data.get('created_at') or 0)
+    started_at = int(data.get('started_at') or 0)
+    if created_at and started_at:
+        metrics.observe('bmo_relay_job_queue_wait_seconds', max(0, started_at - created_at), type=job_type)
+    started = time.perf_counter()
     try:
         result = run_job(job_type, payload)
         done = int(time.time())
-        r.hset(
-            job_key(job_id),
-            mapping={
-                'status': 'success',
-                'finished_at': str(done),
-                'result': json.dumps(result, ensure_ascii=False),
-            },
-        )
+        outcome = {
+            'status': 'success',
+            'finished_at': str(done),
+            **jobqueue.encode_result(r, job_id, result),
+        }
     except Exception as e:
         fail = int(time.time())
-        r.hset(job_key(job_id), mapping={'status': 'failed', 'finished_at': str(fail), 'error': str(e)[:600]})
+        outcome = {'status': 'failed', 'finished_at': str(fail), 'error': str(e)[:600]}
+    metrics.observe('bmo_relay_job_duration_seconds', time.perf_counter() - started, type=job_type)
+    metrics.inc('bmo_relay_jobs_finished_total', type=job_type, status=outcome['status'])
+    if not queue.finish(job_id, token, outcome):
+        print(f'[worker] lease on {job_id} was lost; discarding {outcome["status"]} outcome', flush=True)
+
+
+class JobEngine:
+    """Runs claimed jobs on a bounded thread pool with a per-type concurrency cap.
+
+    The dispatcher only claims jobs whose type still has capacity, so one slow
+    download type never blocks the collects queued behind it. Every job held by
+    the engine keeps its lease renewed until its outcome is committed.
+    """
+
+    def __init__(self, concurrency: int, type_limits: Dict[str, int]):
+        self.concurrency = max(1, concurrency)
+        self.type_limits = type_limits
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._capacity_changed = threading.Condition(self._lock)
+        # bumped whenever a job finishes or a claimable one may have arrived
+        self._wakeups = 0
+        self._running: Dict[str, int] = defaultdict(int)
+        self._held: Dict[str, str] = {}
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='bmo-job')
+
+    def _limit(self, job_type: str) -> int:
+        return max(1, min(self.concurrency, self.type_limits.get(job_type, self.concurrency)))
+
+    def acquire_slot(self) -> None:
+        self._slots.acquire()
+
+    def release_slot(self) -> None:
+        self._slots.release()
+
+    def saturated_types(self) -> List[str]:
+        with self._lock:
+            return [t for t, n in self._running.items() if n >= self._limit(t)]
+
+    def wakeups(self) -> int:
+        with self._lock:
+            return self._wakeups
+
+    def wait_for_capacity(self, timeout: float, since: int) -> None:
+        """Block until wakeups() moves past `since` (a job finished or arrived) or timeout."""
+        with self._lock:
+            self._capacity_changed.wait_for(lambda: self._wakeups != since, timeout)
+
+    def job_arrived(self, job_type: str) -> None:
+        """Wake the dispatcher for a newly queued job unless its type is at its cap here."""
+        with self._lock:
+            if job_type and self._running.get(job_type, 0) >= self._limit(job_type):
+                return
+            self._wakeups += 1
+            self._capacity_changed.notify_all()
+
+    def held_leases(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._held)
+
+    def submit(self, job_id: str, token: str, data: Dict[str, str]) -> None:
+        """Start a claimed job; the caller must hold a slot from acquire_slot()."""
+        job_type = str(data.get('type') or '')
+        with self._lock:
+            self._running[job_type] += 1
+            self._held[job_id] = token
+        self._pool.submit(self._run, job_id, token, data, job_type)
+
+    def _run(self, job_id: str, token: str, data: Dict[str, str], job_type: str) -> None:
+        try:
+            process_job(job_id, token, data)
+        except Exception:
+            # redis write failures must not kill the pool thread; the lease will expire and be reaped
+            traceback.print_exc()
+        finally:
+            with self._lock:
+                self._running[job_type] -= 1
+                self._held.pop(job_id, None)
+                self._wakeups += 1
+                self._capacity_changed.notify_all()
+            self._slots.release()
+
+
+def _type_concurrency_limits() -> Dict[str, int]:
+    limits: Dict[str, int] = {}
+    for job_type, default in JOB_TYPE_DEFAULT_CONCURRENCY.items():
+        raw = str(os.environ.get(f'WORKER_CONCURRENCY_{job_type.upper()}', '')).strip()
+        limits[job_type] = int(raw) if raw.isdigit() and int(raw) > 0 else default
+    return limits
+
+
+def _publish_http_stats_loop() -> None:
+    key = f'{HTTP_STATS_KEY_PREFIX}worker:{WORKER_ID}'
+    metrics_key = f'{metrics.METRICS_KEY_PREFIX}worker:{WORKER_ID}'
+    interval = max(1, HTTP_STATS_PUBLISH_SEC)
+    while True:
+        try:
+            stats = bmo_http.stats()
+            r.hset(key, mapping={k: json.dumps(v) for k, v in stats.items()})
+            r.expire(key, interval * 4)
+            r.set(metrics_key, serde.dumps(metrics.snapshot()), ex=interval * 4)
+        except Exception:
+            pass
+        time.sleep(interval)
+
+
+def _lease_keeper_loop(engine: JobEngine) -> None:
+    """Renew leases of jobs this worker holds and reap jobs abandoned by dead workers."""
+    interval = max(1.0, jobqueue.JOB_LEASE_SEC / 3.0)
+    while True:
+        try:
+            queue.renew(engine.held_leases())
+            requeued, failed = queue.reap()
+            if requeued or failed:
+                print(f'[worker] reaped expired leases: requeued={requeued} failed={failed}', flush=True)
+        except Exception:
+            traceback.print_exc()
+        time.sleep(interval)
+
+
+def _arrivals_loop(engine: JobEngine) -> None:
+    """Pass job arrivals published by the queue on to the engine.
+
+    Every (re)subscribe wakes the dispatcher once, so an arrival missed while the
+    connection was down costs one extra claim instead of a POLL_TIMEOUT wait.
+    """
+    while True:
+        pubsub = r.pubsub()
+        try:
+            pubsub.subscribe(jobqueue.ARRIVALS_CHANNEL)
+            for message in pubsub.listen():
+                kind = message.get('type')
+                if kind == 'subscribe':
+                    engine.job_arrived('')
+                elif kind == 'message':
+                    engine.job_arrived(str(message.get('data') or ''))
+        except Exception:
+            time.sleep(1.0)
+        finally:
+            try:
+                pubsub.close()
+            except Exception:
+                pass
+
+
+def dispatch_jobs(engine: JobEngine, job_queue: jobqueue.JobQueue) -> None:
+    """Feed claimed jobs into the engine; every wake-up goes straight back to claiming."""
+    woken = False
+    while True:
+        engine.acquire_slot()
+        # taken before claiming, so a job finishing or arriving during the claim still wakes us
+        seen = engine.wakeups()
+        claimed = job_queue.claim(engine.saturated_types(), signal_taken=woken)
+        woken = False
+        if claimed:
+            engine.submit(*claimed)
+            continue
+        engine.release_slot()
+        if engine.saturated_types() and job_queue.pending():
+            # everything queued is of a type at its cap here: sleep until one of our jobs
+            # finishes or a job of a type we can still run arrives (_arrivals_loop)
+            engine.wait_for_capacity(POLL_TIMEOUT, seen)
+            continue
+        woken = job_queue.wait_for_jobs(POLL_TIMEOUT)
+
+
+def main() -> None:
+    _sync_auth_from_redis()
+    threading.Thread(target=_auth_invalidation_loop, name='bmo-auth-invalidation', daemon=True).start()
+    threading.Thread(target=_publish_http_stats_loop, name='bmo-http-stats', daemon=True).start()
+    engine = JobEngine(WORKER_CONCURRENCY, _type_concurrency_limits())
+    threading.Thread(target=_lease_keeper_loop, args=(engine,), name='bmo-lease-keeper', daemon=True).start()
+    threading.Thread(target=_arrivals_loop, args=(engine,), name='bmo-job-arrivals', daemon=True).start()
+    dispatch_jobs(engine, queue)
+
+
+if __name__ == '__main__':
+    main()
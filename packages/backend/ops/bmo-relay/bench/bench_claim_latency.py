@@ -0,0 +1,140 @@
+"""Enqueue -> start latency of the worker dispatcher, against a real Redis.
+
+    REDIS_URL=redis://localhost:6379/15 python bench/bench_claim_latency.py [--max-ms 1000]
+
+Runs in-process workers (dispatch_jobs + JobEngine, with run_job replaced by a sleep)
+on a private queue key and times how long queued jobs wait to start:
+
+    saturated  one worker busy with downloads at their cap; a collect queued behind
+               them must start at once instead of after WORKER_POLL_TIMEOUT
+    fan-out    a burst (one pipeline, as /jobs/batch sends it) of long jobs onto idle
+               single-slot workers; every worker must pick one up instead of some
+               blocking on the wake-up signal while jobs sit in the lane
+
+Each scenario runs in its own process so no worker outlives it. Exits non-zero when a
+scenario waits longer than --max-ms past its ideal time.
+"""
+
+import argparse
+import math
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+os.environ.setdefault('JOB_QUEUE_KEY', 'bmo_relay_bench_jobs')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import jobqueue  # noqa: E402
+import serde  # noqa: E402
+import worker  # noqa: E402
+
+_started = {}
+_created = []
+
+
+def _fake_run_job(job_type, payload):
+    _started[payload['n']] = time.perf_counter()
+    time.sleep(float(payload.get('sleep') or 0))
+    return {'ok': True}
+
+
+def enqueue(enqueue_script, job_type, n, sleep, client=None):
+    job_id = f'job_bench_{uuid.uuid4().hex[:12]}'
+    data = {
+        'id': job_id,
+        'type': job_type,
+        'status': 'queued',
+        'priority': jobqueue.DEFAULT_LANE,
+        'payload': serde.dumps({'n': n, 'sleep': sleep}),
+        'created_at': str(int(time.time())),
+    }
+    keys, args = jobqueue.enqueue_call(data, None, False)
+    enqueue_script(keys=keys, args=args, client=client)
+    _created.append(job_id)
+    return time.perf_counter()
+
+
+def start_worker(name, concurrency, limits):
+    engine = worker.JobEngine(concurrency, limits)
+    job_queue = jobqueue.JobQueue(worker.r, f'bench-{name}')
+    threading.Thread(target=worker._arrivals_loop, args=(engine,), daemon=True).start()
+    threading.Thread(target=worker.dispatch_jobs, args=(engine, job_queue), daemon=True).start()
+
+
+def wait_started(count, timeout):
+    deadline = time.perf_counter() + timeout
+    while len(_started) < count and time.perf_counter() < deadline:
+        time.sleep(0.01)
+
+
+def saturated(enqueue_script, max_ms):
+    start_worker('saturated', 4, {'download_attachment': 1, 'collect': 4})
+    for n in range(3):
+        enqueue(enqueue_script, 'download_attachment', f'd{n}', 3.0)
+    wait_started(1, 5)
+    time.sleep(0.3)  # let the worker settle into its idle wait
+    queued_at = enqueue(enqueue_script, 'collect', 'c', 0)
+    wait_started(2, worker.POLL_TIMEOUT + 2)
+    waited_ms = (_started.get('c', float('inf')) - queued_at) * 1000
+    print(f'saturated: collect started {waited_ms:.0f}ms after enqueue (limit {max_ms}ms)')
+    return waited_ms <= max_ms
+
+
+def fan_out(enqueue_script, max_ms, jobs, workers):
+    for i in range(workers):
+        start_worker(f'fan-{i}', 1, {'collect': 1})
+    time.sleep(0.3)  # every worker blocks on the signal before the burst
+    # longer than the limit, so a worker that missed its wake-up cannot hide it by
+    # finishing a job and claiming the next one
+    sleep = max_ms * 2 / 1000.0
+    pipe = worker.r.pipeline(transaction=False)
+    for n in range(jobs):
+        enqueue(enqueue_script, 'collect', n, sleep, client=pipe)
+    first = time.perf_counter()
+    pipe.execute()
+    ideal_ms = (math.ceil(jobs / workers) - 1) * sleep * 1000
+    wait_started(jobs, worker.POLL_TIMEOUT * 3)
+    last = max(_started.values()) if len(_started) == jobs else float('inf')
+    drained_ms = (last - first) * 1000
+    print(f'fan-out: {len(_started)}/{jobs} jobs started on {workers} workers in {drained_ms:.0f}ms '
+          f'(ideal ~{ideal_ms:.0f}ms, limit +{max_ms}ms)')
+    return drained_ms <= ideal_ms + max_ms
+
+
+def cleanup():
+    keys = [jobqueue.PROCESSING_KEY, jobqueue.SIGNAL_KEY, *(jobqueue.lane_key(lane) for lane in jobqueue.LANES)]
+    worker.r.delete(*keys, *(jobqueue.job_key(job_id) for job_id in _created))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-ms', type=int, default=1000)
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--scenario', choices=('saturated', 'fan-out'))
+    args = parser.parse_args()
+
+    if not args.scenario:
+        failed = 0
+        for scenario in ('saturated', 'fan-out'):
+            failed += subprocess.call([sys.executable, os.path.abspath(__file__), *sys.argv[1:], '--scenario', scenario])
+        sys.exit(1 if failed else 0)
+
+    worker.run_job = _fake_run_job
+    enqueue_script = worker.r.register_script(jobqueue.ENQUEUE_LUA)
+    cleanup()
+    try:
+        if args.scenario == 'saturated':
+            ok = saturated(enqueue_script, args.max_ms)
+        else:
+            ok = fan_out(enqueue_script, args.max_ms, args.jobs, args.workers)
+    finally:
+        cleanup()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
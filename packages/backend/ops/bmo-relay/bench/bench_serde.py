@@ -0,0 +1,68 @@
+"""Enqueue -> run -> read cost of one collect job under each installed JSON backend.
+
+    python bench/bench_serde.py [--rows 200] [--rounds 300]
+
+Covers the serialization the API and worker do around a job, without Redis: the
+payload written at enqueue, the payload read and the result encoded (and offloaded)
+by the worker, then the result decoded and the response body rendered on read.
+Backend "json" is the stdlib path every call used before serde.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import jobqueue  # noqa: E402
+import mapper  # noqa: E402
+import serde  # noqa: E402
+from bench_mapper import sample_rows  # noqa: E402
+
+
+class _Blobs(dict):
+    # encode_result only needs SET for offloaded results
+    def set(self, key, value, ex=None):
+        self[key] = value
+
+
+def cycle(payload, result):
+    record = {'id': 'job_1', 'type': 'collect', 'status': 'queued', 'payload': serde.dumps(payload)}
+    # worker: claim, run, commit
+    serde.loads(record['payload'])
+    blobs = _Blobs()
+    record.update(jobqueue.encode_result(blobs, record['id'], result))
+    # API: GET /jobs/{id}?includeResult=1
+    ref = record.get('result_ref')
+    view = {
+        'id': record['id'],
+        'payload': serde.loads(record['payload']),
+        'result': jobqueue.decode_result(record, blobs.get(ref) if ref else None),
+    }
+    return serde.dumps_bytes({'code': 0, 'success': True, 'data': view})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=300)
+    args = parser.parse_args()
+
+    payload = {'pageSize': args.rows, 'offset': 0, 'sorts': {'fd_create_time': 'desc'}, 'conditions': {}}
+    result = {'count': args.rows, 'total': args.rows, 'list': mapper.map_many(sample_rows(args.rows))}
+
+    print(f'{args.rows}-row collect result, {args.rounds} rounds; installed: {", ".join(serde.available())}')
+    baseline = None
+    for name in reversed(serde.available()):
+        serde.use(name)
+        body = cycle(payload, result)
+        seconds = min(timeit.repeat(lambda: cycle(payload, result), number=args.rounds, repeat=3))
+        per_cycle = seconds / args.rounds * 1e3
+        baseline = baseline or per_cycle
+        print(f'{name:8s} {per_cycle:7.3f} ms/cycle  x{baseline / per_cycle:4.1f}  ({len(body)} byte response)')
+
+
+if __name__ == '__main__':
+    main()
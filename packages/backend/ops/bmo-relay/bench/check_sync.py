@@ -0,0 +1,168 @@
+"""End-to-end checks of the sync's removal bookkeeping, against a real Redis.
+
+    REDIS_URL=redis://localhost:6379/15 python bench/check_sync.py
+
+Runs the API's sync (_run_sync_once) with an in-process worker whose collect serves
+rows from an in-memory table, and a local stub for the craftsys persist endpoint.
+Queue, sync and cache keys are moved under a private prefix and the mirror lives in a
+temp directory; job hashes and dedupe keys keep their usual names (and TTLs), so point
+it at a scratch Redis database.
+
+    back-to-back  a full sync right after another one must re-read BMO, not reuse the
+                  collects the first sync finished seconds ago, and report the record
+                  deleted in between as removed
+    shifted       a record deleted behind a full sync's cursor shifts every later offset
+                  by one, so the next page skips a live row; the sync must not report that
+                  row (or any other) as removed
+
+Exits non-zero when a scenario fails.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PREFIX = 'bmo_relay_bench'
+os.environ.setdefault('JOB_QUEUE_KEY', f'{_PREFIX}_jobs')
+for _name in ('STATUS', 'LOCK', 'TRIGGER', 'WATERMARK', 'FINGERPRINT'):
+    os.environ.setdefault(f'BMO_SYNC_{_name}_REDIS_KEY', f'{_PREFIX}:sync:{_name.lower()}')
+os.environ.setdefault('COLLECT_CACHE_REDIS_PREFIX', f'{_PREFIX}:collect:cache:')
+os.environ.setdefault('RELAY_DATA_DIR', tempfile.mkdtemp(prefix='bmo-relay-check-'))
+os.environ.setdefault('BMO_SYNC_PAGE_SIZE', '10')
+os.environ.setdefault('BMO_SYNC_INCREMENTAL', '0')
+# the app is never started, so no background sync runs; scenarios call it directly
+os.environ['BMO_SYNC_ENABLED'] = '1'
+os.environ['CRAFTSYS_BMO_PERSIST_TOKEN'] = 'check'
+
+_persisted = []
+
+
+class _PersistStub(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        payload = json.loads(body)
+        _persisted.append(payload)
+        out = json.dumps({'data': {'removed': len(payload.get('removedIds') or [])}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+_stub = ThreadingHTTPServer(('127.0.0.1', 0), _PersistStub)
+threading.Thread(target=_stub.serve_forever, daemon=True).start()
+os.environ['CRAFTSYS_BMO_PERSIST_URL'] = f'http://127.0.0.1:{_stub.server_port}/relay/persist-mould'
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import api  # noqa: E402
+import jobqueue  # noqa: E402
+import worker  # noqa: E402
+
+# the BMO list as the fake collect sees it right now
+_table = []
+# changes applied to _table right after the next page is served
+_edits = []
+
+
+def _fake_run_job(job_type, payload):
+    offset, size = int(payload.get('offset') or 0), int(payload.get('pageSize') or 50)
+    page = {'list': [dict(row) for row in _table[offset:offset + size]], 'total': len(_table), 'count': len(_table)}
+    try:
+        _edits.pop()()
+    except IndexError:
+        pass
+    return page
+
+
+def _row(n):
+    return {'bmoRecordId': f'id{n}', 'moldNumber': f'M{n:04d}'}
+
+
+def _final_commit():
+    return next((p for p in reversed(_persisted) if p.get('final')), {})
+
+
+async def back_to_back():
+    _table[:] = [_row(n) for n in range(35)]
+    await api._run_sync_once('check', full=True)
+    del _table[7]
+    _persisted.clear()
+    result = await api._run_sync_once('check', full=True)
+    removed = _final_commit().get('removedIds')
+    ok = result['fetched'] == 34 and removed == ['id7']
+    print(f'back-to-back: fetched {result["fetched"]} of 34 live rows, removedIds {removed} (want [\'id7\'])')
+    return ok
+
+
+async def shifted():
+    _table[:] = [_row(n) for n in range(35)]
+    await api._run_sync_once('check', full=True)
+    _persisted.clear()
+    _table[5]['moldNumber'] = 'M0005-changed'  # so the run has something to commit
+    _edits.append(lambda: _table.pop(3))
+    result = await api._run_sync_once('check', full=True)
+    removed = _final_commit().get('removedIds')
+    ok = removed == []
+    print(f'shifted: fetched {result["fetched"]} of {result["total"]} rows, removedIds {removed} (want [])')
+    return ok
+
+
+def cleanup():
+    keys = [
+        api.SYNC_STATUS_KEY,
+        api.SYNC_LOCK_KEY,
+        api.SYNC_TRIGGER_KEY,
+        api.SYNC_WATERMARK_KEY,
+        api.SYNC_FINGERPRINT_KEY,
+        jobqueue.PROCESSING_KEY,
+        jobqueue.SIGNAL_KEY,
+        *(jobqueue.lane_key(lane) for lane in jobqueue.LANES),
+        *worker.r.scan_iter(match=f'{_PREFIX}:collect:cache:*'),
+    ]
+    worker.r.delete(*keys)
+    _persisted.clear()
+    _edits.clear()
+
+
+async def run(names):
+    failed = 0
+    for name in names:
+        cleanup()
+        try:
+            failed += not await SCENARIOS[name]()
+        finally:
+            cleanup()
+    await api.r.aclose()
+    return failed
+
+
+SCENARIOS = {'back-to-back': back_to_back, 'shifted': shifted}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', choices=tuple(SCENARIOS))
+    args = parser.parse_args()
+
+    worker.run_job = _fake_run_job
+    engine = worker.JobEngine(4, {})
+    threading.Thread(target=worker.dispatch_jobs, args=(engine, worker.queue), daemon=True).start()
+    failed = asyncio.run(run([args.scenario] if args.scenario else list(SCENARIOS)))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,9 +16,9 @@ if [[ -z "$job_id" ]]; then
 fi
 
 echo "job_id=${job_id}"
-for _ in $(seq 1 20); do
-  sleep 1
-  st=$(curl -fsS "${BASE_URL}/jobs/${job_id}")
+# long-poll: each request returns as soon as the job finishes (or after waitMs)
+for _ in $(seq 1 2); do
+  st=$(curl -fsS --max-time 30 "${BASE_URL}/jobs/${job_id}?waitMs=10000")
   status=$(printf '%s' "$st" | sed -n 's/.*"status"[[:space:]]*:[[:space:]]*"\([^"]*\)".*/\1/p' | head -n 1)
   if [[ "$status" == "success" || "$status" == "failed" ]]; then
     echo "$st" | sed -n '1,200p'
@@ -12,6 +12,7 @@ const {
   downloadBmoAttachmentByBrowser,
   downloadBmoAttachment,
   upsertBmoRecords,
+  deleteBmoRecords,
   readAuthFromEnvFile
 } = require('../services/bmoSync')
 const { runOnce: runBmoSessionKeeperOnce } = require('../services/bmoSessionKeeper')
@@ -734,14 +735,20 @@ const relayWaitJob = async (jobId, options = {}) => {
   const intervalMs = toSafeInt(options.intervalMs, 1000)
   const start = Date.now()
   while (Date.now() - start < timeoutMs) {
-    const status = await relayRequestJson(`/jobs/${encodeURIComponent(jobId)}`, {
+    // relay 长轮询：任务结束立即返回，最长挂起 waitMs
+    const waitMs = Math.max(0, Math.min(25000, timeoutMs - (Date.now() - start)))
+    const requestedAt = Date.now()
+    const status = await relayRequestJson(`/jobs/${encodeURIComponent(jobId)}?waitMs=${waitMs}`, {
       method: 'GET',
-      timeoutMs: Math.min(15000, timeoutMs)
+      timeoutMs: waitMs + 15000
     })
     const data = status?.data || status
     const state = String(data?.status || '').trim()
     if (state === 'success' || state === 'failed') return data
-    await new Promise((resolve) => setTimeout(resolve, Math.max(200, intervalMs)))
+    // 旧版 relay 不支持 waitMs 会立即返回，此时退回按 intervalMs 轮询
+    if (Date.now() - requestedAt < Math.min(waitMs, intervalMs)) {
+      await new Promise((resolve) => setTimeout(resolve, Math.max(200, intervalMs)))
+    }
   }
   throw new Error(`relay job timeout (${timeoutMs}ms)`)
 }
@@ -2243,13 +2250,14 @@ router.post('/relay/jobs', requireBmoRelayCreate, async (req, res) => {
     }
     const type = String(req.body?.type || '').trim()
     const payload = req.body?.payload && typeof req.body.payload === 'object' ? req.body.payload : {}
+    const priority = String(req.body?.priority || '').trim()
     if (!type) {
       return res.status(400).json({ code: 400, success: false, message: '缺少 type' })
     }
     const relayCreated = await relayRequestJson('/jobs', {
       method: 'POST',
       timeoutMs: 15000,
-      body: { type, payload }
+      body: { type, payload, ...(priority ? { priority } : {}) }
     })
     const normalized = normalizeRelayJob(relayCreated?.data || relayCreated)
     if (!normalized.id) throw new Error('relay 创建任务失败（缺少 jobId）')
@@ -2365,30 +2373,43 @@ router.post('/relay/persist-mould', requireBmoRelayUpdate, async (req, res) => {
   const traceId = String(requestBody.traceId || '').trim() || null
   const source = String(requestBody.source || 'relay').trim() || 'relay'
   const fetched = toSafeInt(requestBody.fetched, list.length)
+  // 流式同步：同一 syncId 的分片逐页到达，只有 final=true 的提交标记写任务日志并处理删除；
+  // 不带 syncId 的旧格式请求按单次整批入库处理
+  const syncId = String(requestBody.syncId || '').trim() || null
+  const isFinal = !syncId || requestBody.final === true
   let taskId = null
 
   try {
-    taskId = await createTaskLog(
-      {
-        source,
-        traceId,
-        fetched,
-        total: toSafeInt(requestBody.total, fetched),
-        fetchedAt: requestBody.fetchedAt || null
-      },
-      `${req.headers['x-username'] || 'relay-sync'}:${source}`
-    )
+    if (isFinal) {
+      taskId = await createTaskLog(
+        {
+          source,
+          traceId,
+          fetched,
+          total: toSafeInt(requestBody.total, fetched),
+          fetchedAt: requestBody.fetchedAt || null
+        },
+        `${req.headers['x-username'] || 'relay-sync'}:${source}`
+      )
+    }
     const upserted = await upsertBmoRecords(list, traceId)
+    const removedIds = isFinal && Array.isArray(requestBody.removedIds) ? requestBody.removedIds : []
+    const removed = removedIds.length ? await deleteBmoRecords(removedIds) : 0
     const summary = {
       source,
+      syncId,
+      final: isFinal,
       fetched,
-      upserted,
+      upserted: upserted + (syncId && isFinal ? toSafeInt(requestBody.upserted, 0) : 0),
+      removed,
+      unchanged: toSafeInt(requestBody.unchanged, 0),
+      mode: String(requestBody.mode || 'full'),
       total: toSafeInt(requestBody.total, fetched),
       traceId,
       fetchedAt: requestBody.fetchedAt || null,
       persistedAt: new Date().toISOString()
     }
-    await updateTaskLogSuccess(taskId, summary)
+    if (isFinal) await updateTaskLogSuccess(taskId, summary)
     return res.json({ code: 0, success: true, data: summary })
   } catch (error) {
     await updateTaskLogFailed(taskId, error)
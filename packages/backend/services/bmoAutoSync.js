@@ -61,14 +61,20 @@ const relayWaitJob = async (jobId, options = {}) => {
   const intervalMs = toSafeInt(options.intervalMs, 1000)
   const start = Date.now()
   while (Date.now() - start < timeoutMs) {
-    const status = await relayRequestJson(`/jobs/${encodeURIComponent(jobId)}`, {
+    // relay 长轮询：任务结束立即返回，最长挂起 waitMs
+    const waitMs = Math.max(0, Math.min(25000, timeoutMs - (Date.now() - start)))
+    const requestedAt = Date.now()
+    const status = await relayRequestJson(`/jobs/${encodeURIComponent(jobId)}?waitMs=${waitMs}`, {
       method: 'GET',
-      timeoutMs: Math.min(15000, timeoutMs)
+      timeoutMs: waitMs + 15000
     })
     const data = status?.data || status
     const state = String(data?.status || '').trim()
     if (state === 'success' || state === 'failed') return data
-    await new Promise((resolve) => setTimeout(resolve, Math.max(200, intervalMs)))
+    // 旧版 relay 不支持 waitMs 会立即返回，此时退回按 intervalMs 轮询
+    if (Date.now() - requestedAt < Math.min(waitMs, intervalMs)) {
+      await new Promise((resolve) => setTimeout(resolve, Math.max(200, intervalMs)))
+    }
   }
   throw new Error(`relay job timeout (${timeoutMs}ms)`)
 }
@@ -216,14 +216,20 @@ const relayWaitJob = async (jobId, options = {}) => {
   const intervalMs = toPositiveInt(options.intervalMs, 1000)
   const start = Date.now()
   while (Date.now() - start < timeoutMs) {
-    const status = await relayRequestJson(`/jobs/${encodeURIComponent(jobId)}`, {
+    // relay 长轮询：任务结束立即返回，最长挂起 waitMs
+    const waitMs = Math.max(0, Math.min(25000, timeoutMs - (Date.now() - start)))
+    const requestedAt = Date.now()
+    const status = await relayRequestJson(`/jobs/${encodeURIComponent(jobId)}?waitMs=${waitMs}`, {
       method: 'GET',
-      timeoutMs: Math.min(15000, timeoutMs)
+      timeoutMs: waitMs + 15000
     })
     const data = status?.data || status
     const state = String(data?.status || '').trim()
     if (state === 'success' || state === 'failed') return data
-    await new Promise((resolve) => setTimeout(resolve, Math.max(200, intervalMs)))
+    // 旧版 relay 不支持 waitMs 会立即返回，此时退回按 intervalMs 轮询
+    if (Date.now() - requestedAt < Math.min(waitMs, intervalMs)) {
+      await new Promise((resolve) => setTimeout(resolve, Math.max(200, intervalMs)))
+    }
   }
   throw new Error(`relay job timeout (${timeoutMs}ms)`)
 }
@@ -1411,6 +1417,29 @@ const upsertBmoRecords = async (records, traceId) => {
   return upserted
 }
 
+const deleteBmoRecords = async (ids) => {
+  const list = [...new Set((Array.isArray(ids) ? ids : []).map((id) => String(id || '').trim()).filter(Boolean))]
+  let removed = 0
+  for (let start = 0; start < list.length; start += 500) {
+    const chunk = list.slice(start, start + 500)
+    const params = {}
+    chunk.forEach((id, index) => {
+      params[`bmoRecordId${index}`] = id
+    })
+    const placeholders = chunk.map((_, index) => `@bmoRecordId${index}`).join(', ')
+    const rows = await query(
+      `
+      DELETE FROM bmo_mould_procurement
+      OUTPUT DELETED.bmo_record_id
+      WHERE bmo_record_id IN (${placeholders})
+    `,
+      params
+    )
+    removed += Array.isArray(rows) ? rows.length : 0
+  }
+  return removed
+}
+
 const syncBmoMouldData = async (input = {}) => {
   const options = {
     fdListViewId: input.fdListViewId || DEFAULT_LIST_QUERY.fdListViewId,
@@ -1531,5 +1560,6 @@ module.exports = {
   downloadBmoAttachmentByBrowser,
   downloadBmoAttachment,
   upsertBmoRecords,
+  deleteBmoRecords,
   readAuthFromEnvFile
 }